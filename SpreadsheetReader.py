@@ -1,43 +1,319 @@
 # Function to read data from spreadsheet
 
-import os, re, shutil, csv
-from pprintpp import pprint as pp
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font
+import os, sys, re, shutil, csv, argparse, hashlib, json, time, tracemalloc, queue, threading, sqlite3, importlib
+from collections import Counter, deque
+from collections.abc import Mapping, MutableMapping, Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, closing, nullcontext, redirect_stdout
+from functools import lru_cache
+from itertools import repeat, zip_longest, compress, islice
+from array import array
 from datetime import date
 from pathlib import Path
 
-def getSpreadsheetValues(filename):
-    ''' Gets spreadsheet by name and returns the spreadsheet as a worksheet and a list of column headings '''
-    #path = os.path.join('data', filename) 
-    wb = load_workbook(filename)
+# openpyxl, numpy and pyarrow are imported in the functions that use them, so importing this module does no work
+
+# where the spreadsheets are read from and the output is written to, set with configureDirectories
+dataDirectories = {"data": "data", "output": os.path.join("data", "converted"), "lib": os.path.join("data", "lib"), "summary": os.path.join("data", "summary")}
+
+def configureDirectories(dataDir="data", outputDir=None, libDir=None, summaryDir=None):
+    ''' Set the data directory and the output, lib and summary directories, which default to converted, lib and summary in the data directory '''
+    dataDirectories["data"] = dataDir
+    dataDirectories["output"] = outputDir if outputDir is not None else os.path.join(dataDir, "converted")
+    dataDirectories["lib"] = libDir if libDir is not None else os.path.join(dataDir, "lib")
+    dataDirectories["summary"] = summaryDir if summaryDir is not None else os.path.join(dataDir, "summary")
+
+def directory(name, *parts):
+    ''' return a path in one of the configured directories: data, output, lib or summary '''
+    return os.path.join(dataDirectories[name], *parts)
+
+def checkOutputDirectory():
+    ''' raise ValueError if the output directory is, or holds, the data, lib or summary directory, as it is cleared before the output is written '''
+    output = os.path.realpath(directory('output'))
     
-    sheet = wb.worksheets[0]
-    values={}
+    for name in ("data", "lib", "summary"):
+        if os.path.commonpath([output, os.path.realpath(directory(name))]) == output:
+            raise ValueError("the output directory " + directory('output') + " is cleared before each run, so it cannot be or hold the " + name + " directory " + directory(name))
+
+@lru_cache(maxsize=None)
+def optionalModule(name):
+    ''' import an optional dependency the first time it is needed, returning None if it is not installed '''
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+# columns expected in each input spreadsheet
+inputColumns = ['Letter','Series','Piece', 'Item', 'Treasury case number', 'Home Office case number', 'First names/Initials', 'Surname', 'Age', 'Occupation', 'Award granted', 'Brief summary of grounds for recommendation', 'Additional Information']
+requiredColumns = ['Item', 'Age', 'Brief summary of grounds for recommendation', 'Additional Information']
+
+def getSpreadsheetColumns(filename, columns=None):
+    ''' Streams the first sheet of the spreadsheet and returns a list of the column headings and a CompactTable of column values by heading, of just the given columns if any '''
+    from openpyxl import load_workbook
     
-    for col in sheet.columns:
-        #column = [cell.value for cell in col if cell.value is not None]
-        column = [cell.value if cell.value is not None else "" for cell in col]
+    wb = load_workbook(filename, read_only=True)
+    
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        headingRow = next(rows, ())
+        
+        headings = [str(heading).strip() if heading is not None else "" for heading in headingRow]
+        nonBlank = [heading is not None for heading in headingRow]
+        data = [CompactColumn() if columns is None or heading in columns else None for heading in headings]
+        rowCount = 0
+        lastRowWithValues = 0
         
-        if len(column) > 0 and column.count("") != len(column):
-            values[str(column[0]).strip()] = column[1:]
+        for row in rows:
+            if len(row) > len(headings):
+                for index in range(len(headings), len(row)):
+                    headings.append("")
+                    nonBlank.append(False)
+                    data.append(CompactColumn(repeat("", rowCount)) if columns is None or "" in columns else None)
+            
+            for index, column in enumerate(data):
+                value = row[index] if index < len(row) else None
+                
+                if value is not None:
+                    nonBlank[index] = True
+                    lastRowWithValues = rowCount + 1
+                    
+                if column is not None:
+                    column.append(value)
             
-    return (values)
+            rowCount += 1
+    finally:
+        wb.close()
+    
+    values = {}
+    
+    # the dimensions stored in the file can include empty rows at the end, which a full load would not return
+    for heading, hasValues, column in zip(headings, nonBlank, data):
+        if hasValues:
+            if column is not None:
+                column.truncate(lastRowWithValues)
+                column.compact()
+            values[heading] = column
+    
+    return (list(values.keys()), CompactTable((heading, column) for heading, column in values.items() if column is not None))
+
+class CompactTable(MutableMapping):
+    ''' The columns of a spreadsheet by heading, which reads and updates like a dictionary of lists but stores each column as a CompactColumn '''
+    
+    def __init__(self, columns=()):
+        self.columns = {}
+        
+        for heading, column in columns:
+            self[heading] = column
+    
+    def __getitem__(self, heading):
+        return self.columns[heading]
+    
+    def __setitem__(self, heading, column):
+        self.columns[heading] = column if isinstance(column, CompactColumn) else CompactColumn(column).compact()
+    
+    def __delitem__(self, heading):
+        del self.columns[heading]
+    
+    def __iter__(self):
+        return iter(self.columns)
+    
+    def __len__(self):
+        return len(self.columns)
+
+class CompactColumn(Sequence):
+    ''' A column of spreadsheet values with whole numbers kept in an array, a repeated value kept once and blanks read back as "" '''
+    
+    # longer strings, like the descriptions, are rarely repeated so are not worth interning
+    internLength = 64
+    
+    def __init__(self, values=()):
+        self.kind = "ints"
+        self.ints = array('q')
+        self.values = None
+        self.constant = None
+        self.length = 0
+        self.blanks = 0
+        self.bitmap = bytearray()
+        
+        # a list of whole numbers, like the opening years, is copied into the array in one go
+        if type(values) is list and allInts(values) and all(-2**63 <= value < 2**63 for value in (min(values, default=0), max(values, default=0))):
+            self.ints = array('q', values)
+            self.fill(len(values))
+            return
+        
+        for value in values:
+            self.append(value)
+    
+    @classmethod
+    def fromArray(cls, intArray):
+        ''' return a column of the whole numbers in a numpy integer array, copied into the column's array in one go '''
+        np = optionalModule("numpy")
+        column = cls()
+        column.ints.frombytes(np.ascontiguousarray(intArray, dtype=np.int64).tobytes())
+        column.fill(len(column.ints))
+        return column
+    
+    def fill(self, length):
+        ''' mark the given number of rows as all having values, for a column set up with its values in one go '''
+        self.length = length
+        self.bitmap = bytearray(b'\xff' * (length // 8))
+        
+        if length & 7:
+            self.bitmap.append((1 << (length & 7)) - 1)
+    
+    def append(self, value):
+        ''' add a value to the end of the column, where None or "" is a blank cell '''
+        blank = value is None or value == ""
+        
+        if self.kind == "constant" or (self.kind == "ints" and not blank and (type(value) is not int or not -2**63 <= value < 2**63)):
+            self.expand()
+        
+        if self.length % 8 == 0:
+            self.bitmap.append(0)
+        
+        if not blank:
+            self.bitmap[self.length >> 3] |= 1 << (self.length & 7)
+        else:
+            self.blanks += 1
+        
+        if self.kind == "ints":
+            self.ints.append(0 if blank else value)
+        else:
+            self.values.append("" if blank else sys.intern(value) if type(value) is str and len(value) < self.internLength else value)
+        
+        self.length += 1
+    
+    def expand(self):
+        ''' switch to keeping the values in a list, for a value that is not a whole number '''
+        values = list(self)
+        self.kind, self.ints, self.values, self.constant = "values", None, values, None
+    
+    def compact(self):
+        ''' keep the value just once if it fills every row of the column, and return the column '''
+        if self.kind != "constant" and self.length > 0 and self.presentCount() == self.length:
+            first = self[0]
+            
+            if all(type(value) is type(first) and value == first for value in self):
+                self.kind, self.ints, self.values, self.constant = "constant", None, None, first
+        
+        return self
+    
+    def truncate(self, length):
+        ''' remove the rows after the given length '''
+        if length >= self.length:
+            return
+        
+        if self.kind == "ints":
+            del self.ints[length:]
+        elif self.kind == "values":
+            del self.values[length:]
+        
+        del self.bitmap[(length + 7) // 8:]
+        
+        if length & 7:
+            self.bitmap[-1] &= (1 << (length & 7)) - 1
+        
+        self.length = min(self.length, length)
+        self.blanks = self.length - self.presentCount()
+    
+    def isPresent(self, index):
+        return self.bitmap[index >> 3] >> (index & 7) & 1
+    
+    def presentBits(self):
+        return (byte >> bit & 1 for byte in self.bitmap for bit in range(8))
+    
+    def presentCount(self):
+        return sum(bin(byte).count("1") for byte in self.bitmap)
+    
+    def present(self):
+        ''' return the values of the rows that are not blank, read through the bitmap rather than copied '''
+        return PresentValues(self)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("column index out of range")
+        
+        if self.kind == "constant":
+            return self.constant
+        if not self.isPresent(index):
+            return ""
+        return self.ints[index] if self.kind == "ints" else self.values[index]
+    
+    def __iter__(self):
+        if self.kind == "constant":
+            return repeat(self.constant, self.length)
+        if self.kind == "values":
+            return iter(self.values)
+        if self.blanks == 0:
+            return iter(self.ints)
+        return (value if present else "" for value, present in zip(self.ints, self.presentBits()))
+    
+    def __len__(self):
+        return self.length
+
+def asCompactColumn(values):
+    ''' return the values as a CompactColumn, unless they already are one '''
+    return values if isinstance(values, CompactColumn) else CompactColumn(values)
+
+class PresentValues:
+    ''' The values in the rows of a CompactColumn that are not blank, which can be iterated over as many times as needed '''
+    
+    def __init__(self, column):
+        self.column = column
+    
+    def __iter__(self):
+        return compress(self.column, self.column.presentBits())
+    
+    def __len__(self):
+        return self.column.presentCount()
+
+def getSpreadsheetValues(filename, columns=None):
+    ''' Gets spreadsheet by name and returns a dictionary of column values by heading, optionally limited to the given list of columns '''
+    return getSpreadsheetColumns(filename, columns)[1]
 
 def getCoveringDatesbyPiece(filename):
-    '''Gets a list of covering dates for each piece if there is a file with the specified name in the data/lib folder'''
+    ''' Gets a dictionary of covering dates (as int years) by piece if there is a file with the specified name in the lib folder, reporting pieces listed more than once '''
     coveringDates = dict()
 
-    if os.path.exists(os.path.join('data','lib', filename)):
-        with open(os.path.join('data','lib', filename)) as dateFile:
+    if os.path.exists(directory('lib', filename)):
+        with open(directory('lib', filename)) as dateFile:
             reader = csv.reader(dateFile, skipinitialspace=True)  
-            coveringDates = {(int(line[0]) if line[0].isnumeric else line[0]):(int(line[1]) if line[1].isnumeric else line[1]) for line in reader}   
+            
+            for lineNumber, line in enumerate(reader, 1):
+                if len(line) == 0:
+                    continue
+                
+                if len(line) < 2 or not line[1].strip().isnumeric():
+                    print("Invalid covering date on line " + str(lineNumber) + " of " + filename + ": " + ",".join(line))
+                    continue
+                
+                piece = int(line[0]) if line[0].strip().isnumeric() else line[0].strip()
+                
+                if piece in coveringDates:
+                    print("Piece " + str(piece) + " listed more than once in " + filename + ", using covering date on line " + str(lineNumber))
+                
+                coveringDates[piece] = int(line[1])
     else:
-        print("No covering dates specified at " + os.path.join('lib', filename))
+        print("No covering dates specified at " + directory('lib', filename))
     
     return coveringDates
 
+def getCoveringDateForFile(file, coveringDates):
+    ''' Get the covering date for the piece of a spreadsheet, "" if there are no covering dates and None if the piece is missing from them '''
+    if len(coveringDates) == 0:
+        return ""
+    
+    return coveringDates.get(getPieceFromFilename(file))
+
 def removeBlanksFromColumn(column):
+    ''' return the values in a column that are not blank, which for a CompactColumn are read through its bitmap rather than copied '''
+    if isinstance(column, CompactColumn):
+        return column.present()
     return [value for value in column if value != ""]  
 
 def getAgeFromColumn(column):
@@ -45,14 +321,62 @@ def getAgeFromColumn(column):
     # if value is number then age otherwise default value      
     return [entry if str(entry).strip().isnumeric() else 18 for entry in removeBlanksFromColumn(column)]         
 
-def getYearFromColumn(column, coveringDate):
-    ''' Get year from named column and return a dictionary of years and covering dates'''
-    # regex for dddd in text value
-    # since Python 3.8 := allows you to name an evaluation as a variable which you can use int he list comparhension see https://stackoverflow.com/questions/26672532/how-to-set-local-variable-in-list-comprehension 
-    years = [int(years[0]) if len(years := re.findall(r'\d{4}', entry)) == 1 else years for entry in removeBlanksFromColumn(column)] 
-    #pp(years)
+def getYearFromColumn(column, coveringDate, dateWindow=(1935, 1946)):
+    ''' Get year from named column and return an iterator of years and covering dates, using the date extractor for the given window of years'''
+    extractor = getDateExtractor(*dateWindow)
        
-    return codifyYears(years, coveringDate)
+    return (extractor.extract(entry, coveringDate) for entry in removeBlanksFromColumn(column))
+
+class DateExtractor:
+    ''' Extracts the year and covering dates from a description in a single scan, giving the same results as codifyYears '''
+    
+    # regex for dddd in text value
+    pattern = re.compile(r'\d{4}')
+    
+    def __init__(self, earliest=1935, latest=1946, cacheSize=65536):
+        self.earliest = earliest
+        self.latest = latest
+        self.scan = lru_cache(maxsize=cacheSize)(self.scanDescription)
+    
+    def scanDescription(self, entry):
+        ''' return the number of years in the description, the first year, the earliest year and the latest year before the end of the window (or None) '''
+        count = 0
+        first = earliestYear = latestBeforeEnd = None
+        
+        for match in self.pattern.finditer(entry):
+            year = int(match.group())
+            count += 1
+            
+            if first is None:
+                first = earliestYear = year
+            elif year < earliestYear:
+                earliestYear = year
+            
+            if year < self.latest and (latestBeforeEnd is None or year > latestBeforeEnd):
+                latestBeforeEnd = year
+        
+        return (count, first, earliestYear, latestBeforeEnd)
+    
+    def extract(self, entry, coveringDate=""):
+        ''' return the codified year and the covering dates of a description, defaulting to the covering date '''
+        count, first, earliestYear, latestBeforeEnd = self.scan(entry)
+        
+        if count == 1:
+            if first < self.earliest or first > self.latest:
+                return (coveringDate, coveringDate)
+            return (first, first)
+        
+        if count > 1:
+            latestDate = latestBeforeEnd if latestBeforeEnd is not None else coveringDate
+            earliestDate = earliestYear if self.earliest < earliestYear < self.latest else coveringDate
+            return (latestDate, str(earliestDate) + " - " + str(latestDate))
+        
+        return (coveringDate, coveringDate)
+
+@lru_cache(maxsize=None)
+def getDateExtractor(earliest=1935, latest=1946):
+    ''' return the date extractor for a window of years, so its memory of descriptions is kept for the whole run in each process '''
+    return DateExtractor(earliest, latest)
 
 def getDateFromList(dateList, earliest, latest, default, max=True):
     foundDate = -1
@@ -67,10 +391,8 @@ def getDateFromList(dateList, earliest, latest, default, max=True):
         
     return foundDate
 
-def codifyYears(yearsList, coveringDate=""):
+def codifyYears(yearsList, coveringDate="", earliest=1935, latest=1946):
     defaultYear = coveringDate
-    earliest = 1935
-    latest = 1946
     codifiedYears = []
     coveringDates = []
        
@@ -136,6 +458,15 @@ def sheetRedactionNeededCheck(openingList):
     ''' return False if no opening dates in the given list are later than the current year'''
     return False if max(openingList) <= date.today().year else True
        
+def groupRowsByOpeningYear(openingList):
+    ''' return the indexes of the rows by the year they open in '''
+    rowsByOpeningYear = {}
+    
+    for index, openingYear in enumerate(openingList):
+        rowsByOpeningYear.setdefault(openingYear, []).append(index)
+    
+    return rowsByOpeningYear
+
 def selectByYear(previousRedactionList, currentRedactionList):
     ''' Return filter of changed redaction'''    
     return [False if a == b else True for a, b in zip(previousRedactionList, currentRedactionList)]    
@@ -143,9 +474,104 @@ def selectByYear(previousRedactionList, currentRedactionList):
 def yearsToPublish(openingList, year=date.today().year):
     return list(range(year, max(openingList)+1))
 
-def redactColumns(columnsToRedact, openingList, lastYearInSeries, year=date.today().year, minimum=True):
-    ''' given a dictionary containung the columns that may need redacting, return a dict containing the original record values and
-    the processed values for each year, by year, until all records have been opened. 
+### NumPy engine ###
+
+def allInts(values):
+    return all(type(value) is int for value in values)
+
+def toIntArray(values):
+    ''' return the values as a numpy integer array, or None unless they are all ints. The array of a CompactColumn of ints is used without copying it '''
+    np = optionalModule("numpy")
+    
+    if isinstance(values, CompactColumn):
+        if values.kind == "ints" and values.blanks == 0:
+            return np.frombuffer(values.ints, dtype=np.int64)
+        if values.kind == "constant":
+            return np.full(len(values), values.constant, dtype=np.int64) if type(values.constant) is int else None
+        if values.kind == "ints":
+            return None
+        values = values.values
+    
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    
+    intArray = np.array(values)
+    return intArray if intArray.dtype.kind == "i" else None
+
+def deceasedMask(additionalInfoList, length):
+    ''' return a boolean array which is True for each of the first length rows that have the word Deceased in the additional info '''
+    np = optionalModule("numpy")
+    return np.fromiter(("Deceased" in additionalInfo for additionalInfo in islice(additionalInfoList, length)), dtype=bool, count=min(length, len(additionalInfoList)))
+
+def createOpeningArray(ageArray, yearArray):
+    ''' return an array of the years in which the records will be open given arrays of ages and years '''
+    return yearArray - ageArray + 101
+
+def unredactIfDeceasedArray(openingArray, deceased):
+    ''' return the opening array with the opening year set to the current year where the person is dead '''
+    np = optionalModule("numpy")
+    openingArray = openingArray[:len(deceased)]
+    return np.where(deceased & (openingArray > date.today().year), date.today().year, openingArray)
+
+def createOpeningListNumpy(agesList, yearsList):
+    ''' numpy version of createOpeningList returning a CompactColumn, which it falls back to unless the ages and years are all ints '''
+    ageArray, yearArray = toIntArray(agesList), toIntArray(yearsList)
+    
+    if ageArray is None or yearArray is None:
+        return createOpeningList(agesList, yearsList)
+    
+    length = min(len(ageArray), len(yearArray))
+    return CompactColumn.fromArray(createOpeningArray(ageArray[:length], yearArray[:length]))
+
+def unredactIfDeceasedNumpy(openingList, additionalInfoList):
+    ''' numpy version of unredactIfDeceased returning a CompactColumn, which it falls back to unless the opening years are all ints '''
+    openingArray = toIntArray(openingList)
+    
+    if openingArray is None:
+        return unredactIfDeceased(openingList, additionalInfoList)
+    
+    return CompactColumn.fromArray(unredactIfDeceasedArray(openingArray, deceasedMask(additionalInfoList, len(openingArray))))
+
+def sheetRedactionNeededCheckNumpy(openingList):
+    ''' numpy version of sheetRedactionNeededCheck, which it falls back to unless the opening years are all ints '''
+    openingArray = toIntArray(openingList)
+    
+    if openingArray is None:
+        return sheetRedactionNeededCheck(openingList)
+    
+    return bool(openingArray.max() > date.today().year)
+
+def groupRowsByOpeningYearNumpy(openingList):
+    ''' numpy version of groupRowsByOpeningYear, sorting the rows by opening year and splitting them where the year changes '''
+    np = optionalModule("numpy")
+    openingArray = toIntArray(openingList)
+    
+    if openingArray is None or len(openingArray) == 0:
+        return groupRowsByOpeningYear(openingList)
+    
+    order = np.argsort(openingArray, kind="stable")
+    sortedYears = openingArray[order]
+    starts = np.flatnonzero(sortedYears[1:] != sortedYears[:-1]) + 1
+    return dict(zip(sortedYears[np.concatenate(([0], starts))].tolist(), (rows.tolist() for rows in np.split(order, starts))))
+
+# functions used to work out the opening years, whether any rows need redacting and the rows that open in each year by each engine
+openingEngines = {
+    "python": (createOpeningList, unredactIfDeceased, sheetRedactionNeededCheck, groupRowsByOpeningYear),
+    "numpy": (createOpeningListNumpy, unredactIfDeceasedNumpy, sheetRedactionNeededCheckNumpy, groupRowsByOpeningYearNumpy)
+}
+
+def checkEngine(engine):
+    ''' raise an error before any work is handed out if the engine is unknown or its module is not installed '''
+    if engine not in openingEngines:
+        raise ValueError("unknown engine " + str(engine) + ", expected one of " + ", ".join(openingEngines))
+    
+    if engine == "numpy" and optionalModule("numpy") is None:
+        raise ImportError("the numpy engine needs numpy to be installed")
+
+def redactColumns(columnsToRedact, openingList, lastYearInSeries, year=date.today().year, minimum=True, groupRows=groupRowsByOpeningYear):
+    ''' given a dictionary containung the columns that may need redacting, return a RedactionSchedule containing the original record values and
+    the processed values for each year, by year, until all records have been opened. The schedule reads like the dict below, but each year is 
+    only worked out when it is asked for, from the rows grouped by opening year. 
     
     {"base": [{col1Name:col1, col2Name:col2}], 
     year: [{filter: filter, col1Name: col1_redacted, col2Name: col2_redacted], 
@@ -156,277 +582,1430 @@ def redactColumns(columnsToRedact, openingList, lastYearInSeries, year=date.toda
     
     boilerplate = "[Additional information regarding this case will be added to the catalogue when the case becomes over 100 years old. In cases when the date is not known, the latest date in the series (" + str(lastYearInSeries) + ") will be used]"
     
-    processedColumns = {"base":columnsToRedact}
+    return RedactionSchedule(columnsToRedact, openingList, boilerplate, groupRows(openingList))
+
+class RedactionSchedule(Mapping):
+    ''' The redacted columns for each year as returned by redactColumns, worked out when asked for from the rows grouped by opening year '''
     
-    yearsToPublishList = yearsToPublish(openingList)
-    previousRedactions = []
+    def __init__(self, columnsToRedact, openingList, boilerplate, rowsByOpeningYear=None):
+        self.base = columnsToRedact
+        self.openingList = openingList
+        self.boilerplate = boilerplate
+        self.years = yearsToPublish(openingList)
+        self.rowsByOpeningYear = rowsByOpeningYear if rowsByOpeningYear is not None else groupRowsByOpeningYear(openingList)
     
-    for currentYear in yearsToPublishList:
-        #print(currentYear)
-        
-        toRedact = [True if currentYear < openingYear else False for openingYear in openingList]
-        #test_redactByYear_testFile(toRedact, currentYear)
-        #print(toRedact)
-        
-        filter = [True] * len(openingList)
-        
-        if previousRedactions == []:
-            previousRedactions = toRedact
-        else:
-            filter = selectByYear(previousRedactions, toRedact)
-            previousRedactions = toRedact
-        
-        #test_selectByYear_testFile(filter, currentYear)
-        
-        processedColumns[currentYear] = {"filter": filter}
+    def delta(self, year):
+        ''' return the indexes of the rows that change in the given year, which is every row in the first year '''
+        if year == self.years[0]:
+            return list(range(len(self.openingList)))
+        return self.rowsByOpeningYear.get(year, [])
+    
+    def __getitem__(self, key):
+        if key == "base":
+            return self.base
+        if key not in self.years:
+            raise KeyError(key)
+        return RedactedYear(self, key)
+    
+    def __iter__(self):
+        yield "base"
+        yield from self.years
+    
+    def __len__(self):
+        return len(self.years) + 1
+
+class RedactedYear(Mapping):
+    ''' The filter and redacted columns of a RedactionSchedule for one year '''
+    
+    def __init__(self, schedule, year):
+        self.schedule = schedule
+        self.year = year
     
-        for columnName, column in columnsToRedact.items():
-            newColumn = [boilerplate if record[1] and record[0] != "" else record[0] for record in zip(column, toRedact)]   
-            processedColumns[currentYear][columnName]=newColumn
+    def rowIndexes(self):
+        ''' return the indexes of the rows selected by the filter '''
+        return self.schedule.delta(self.year)
+    
+    def __getitem__(self, key):
+        if key == "filter":
+            filter = [False] * len(self.schedule.openingList)
+            for index in self.rowIndexes():
+                filter[index] = True
+            return filter
+        return RedactedColumn(self.schedule.base[key], self.schedule.openingList, self.year, self.schedule.boilerplate)
+    
+    def __iter__(self):
+        yield "filter"
+        yield from self.schedule.base
+    
+    def __len__(self):
+        return len(self.schedule.base) + 1
+
+class RedactedColumn(Sequence):
+    ''' A column with the boilerplate in place of each value that is not yet open in the given year '''
+    
+    def __init__(self, column, openingList, year, boilerplate):
+        self.column = column
+        self.openingList = openingList
+        self.year = year
+        self.boilerplate = boilerplate
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        
+        value = self.column[index]
+        return self.boilerplate if self.year < self.openingList[index] and value != "" else value
     
-    return processedColumns
+    def __len__(self):
+        return min(len(self.column), len(self.openingList))
 
 def pathToFile(year):
-    path = os.path.join('data', 'converted',str(year))
-    if not os.path.exists(path):
-        os.makedirs(path)
+    path = directory('output', str(year))
+    os.makedirs(path, exist_ok=True)
     return path
 
-def unredactByYear(filename, values, newValues, year, min=True):
-    ''' print out a new spreadsheet with the full text for all columns for just the rows where the year is 100 years since birth'''
+outputFormats = ["xlsx", "csv", "parquet"]
+
+# a file for each piece for each year, a file for each piece with all its years, or a release file for each year with all the pieces
+outputLayouts = ["year", "piece", "release"]
+
+def outputExtension(filename, outputFormat="xlsx"):
+    ''' return the extension of an output file, which is the extension of the input spreadsheet for xlsx output '''
+    return os.path.splitext(os.path.basename(filename))[1] if outputFormat == "xlsx" else "." + outputFormat
+
+def writeRows(newFile, headings, rows, outputFormat="xlsx", integerHeadings=()):
+    ''' write the rows out to a new file as a spreadsheet, csv or parquet file, by way of a temporary file, and return the number of rows written '''
+    if outputFormat == "csv":
+        rowCount = writeCsv(newFile + '.tmp', headings, rows)
+    elif outputFormat == "parquet":
+        rowCount = writeParquet(newFile + '.tmp', headings, rows, integerHeadings)
+    else:
+        rowCount = writeSpreadsheet(newFile + '.tmp', headings, rows)
     
-    wb = Workbook()
-    newSheet = wb.active
+    os.replace(newFile + '.tmp', newFile)
+    return rowCount
+
+def writeCsv(newFile, headings, rows):
+    ''' stream the rows out to a new csv file under a row of headings, with empty cells left blank, and return the number of rows '''
+    rowCount = 0
     
-    col = 1
+    with open(newFile, 'w', newline='', encoding='utf-8') as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(headings)
+        for row in rows:
+            writer.writerow(row)
+            rowCount += 1
     
-    #print(values)
+    return rowCount
+
+def parquetSchema(headings, integerHeadings=()):
+    ''' return the schema of a parquet file with the given headings, with whole numbers under integerHeadings and text elsewhere '''
+    pa = optionalModule("pyarrow")
     
-    #print(newValues[year].keys())
+    headings = list(headings)
+    # duplicate or blank headings are not allowed as parquet column names
+    names = [heading if heading != "" and headings.index(heading) == index else heading + "_" + str(index) for index, heading in enumerate(headings)]
+    return pa.schema([(name, pa.int64() if heading in integerHeadings else pa.string()) for name, heading in zip(names, headings)])
+
+def arrowColumn(values, columnType):
+    ''' return a pyarrow array of the values in a column of the given type from parquetSchema. Blank values are null, and values in a text column are stored as text '''
+    pa = optionalModule("pyarrow")
     
-    filter = newValues[year]["filter"]
+    if pa.types.is_string(columnType):
+        return pa.array([None if value is None or value == "" else str(value) for value in values], type=columnType)
     
-    for title, column in values.items():
-        newSheet.cell(1, col, title).font = Font(bold=True)
+    return pa.array([None if value == "" else value for value in values], type=columnType)
+
+def writeParquet(newFile, headings, rows, integerHeadings=()):
+    ''' write the rows out to a new parquet file, one column per heading, and return the number of rows '''
+    pa = optionalModule("pyarrow")
     
-        row = 2
-        
-        if title in newValues[year].keys():
-            column = newValues[year][title]
+    if pa is None:
+        raise ImportError("parquet output needs pyarrow to be installed")
+    
+    pq = importlib.import_module("pyarrow.parquet")
+    
+    headings = list(headings)
+    schema = parquetSchema(headings, integerHeadings)
+    columns = [[] for heading in headings]
+    rowCount = 0
+    
+    for row in rows:
+        rowCount += 1
+        for column, value in zip_longest(columns, row):
+            if column is not None:
+                column.append(value)
+    
+    pq.write_table(pa.table([arrowColumn(column, field.type) for column, field in zip(columns, schema)], schema=schema), newFile)
+    return rowCount
 
-        filteredColumn = zip(column, filter)           
+def writeSpreadsheet(newFile, headings, rows):
+    ''' stream the rows out to a new spreadsheet in write-only mode under a row of bold headings, and return the number of rows '''
+    from openpyxl import Workbook
+    
+    wb = Workbook(write_only=True)
+    newSheet = wb.create_sheet()
+    rowCount = 0
+    
+    newSheet.append([boldCell(newSheet, heading) for heading in headings])
+    
+    for row in rows:
+        newSheet.append(row)
+        rowCount += 1
+        
+    wb.save(newFile)
+    return rowCount
 
-        for filteredRow in filteredColumn:
-            #print(str(row[1]) + ": " + str(x) + ", " + str(y))
-            if (min and filteredRow[1]) or not min:
-                newSheet.cell(row, col, filteredRow[0])
-                row+=1
-            
-        col+=1 
+def unredactByYear(filename, values, newValues, year, min=True, outputFormat="xlsx", written=None):
+    ''' print out a new spreadsheet (or csv or parquet file) with the full text for all columns for just the rows where the year is 100 years since birth'''
+    
+    #print(newValues[year].keys())
+    
+    rowIndexes, rows = yearRows(values, newValues, year, min)
     
-    #print("Last cel written for " + str(year) + " x:" + str(row) + ", y: " + str(col))
-    if row > 2:   
+    if len(rowIndexes) > 0:   
         path = pathToFile(year)  
-        newFilename = os.path.splitext(os.path.basename(filename))[0] + "_" + str(year) + os.path.splitext(os.path.basename(filename))[1]
+        newFilename = os.path.splitext(os.path.basename(filename))[0] + "_" + str(year) + outputExtension(filename, outputFormat)
         newFile = os.path.join(path, newFilename)  
-        wb.save(newFile)
+        if written is not None:
+            rows = written.track(newFile, values.keys(), rowIndexes, rows)
+        rowCount = writeRows(newFile, values.keys(), rows, outputFormat)
+        if written is not None:
+            written.wrote(newFile, rowCount)
+        return newFile
+
+def yearRows(values, newValues, year, min=True):
+    ''' return the indexes of the rows published in the given year and a generator of those rows with the redacted values for the year '''
+    yearValues = newValues[year]
+    columns = [yearValues[title] if title in yearValues.keys() else column for title, column in values.items()]
+    
+    # rows are only written up to the length of the filter, as they were when each column was zipped with it
+    if min and hasattr(yearValues, "rowIndexes"):
+        rowIndexes = yearValues.rowIndexes()
+    else:
+        rowIndexes = [index for index, selected in enumerate(yearValues["filter"]) if (min and selected) or not min]
+    
+    return (rowIndexes, ([column[index] if index < len(column) else None for column in columns] for index in rowIndexes))
 
-def spreadsheetNoRedactions(filename, values):
-    ''' print out a new spreadsheet with the full text for all columns'''
+class WrittenRows:
+    ''' Counts and keeps the Item of the rows handed to the writer of each output, and the rows it says it wrote, for writePiece to check '''
+    
+    def __init__(self):
+        self.outputs = {}
+        self.files = {}
+    
+    def track(self, name, headings, rowIndexes, rows):
+        ''' pass on the rows of the named output, where rowIndexes are the rows of the piece they should be '''
+        headings = list(headings)
+        position = headings.index('Item') if 'Item' in headings else None
+        output = self.outputs[name] = {"name": name, "rowIndexes": rowIndexes, "rows": 0, "written": None, "items": []}
+        return self.passOn(output, position, rows)
+    
+    def passOn(self, output, position, rows):
+        ''' yield the rows, counting them and keeping the Item of each '''
+        for row in rows:
+            output["rows"] += 1
+            if position is not None:
+                output["items"].append(row[position] if position < len(row) else None)
+            yield row
+    
+    def wrote(self, name, rowCount):
+        ''' record the number of rows the writer of the named output wrote '''
+        self.outputs[name]["written"] = rowCount
+    
+    def wroteTogether(self, newFile, names, rowCount):
+        ''' record the number of rows the writer wrote to one file holding all the named outputs '''
+        self.files[newFile] = {"file": newFile, "names": names, "written": rowCount}
+
+def releasesByYear(values, newValues=None, openingList=None, written=None, name=None):
+    ''' return the (year, rows) of each release of a piece: every row in the first year and then the rows that open in each later year '''
+    if newValues is None:
+        rowCount = max(map(len, values.values()), default=0)
+        releases = [(date.today().year, (range(rowCount), zip_longest(*values.values())))] if rowCount > 0 else []
+    else:
+        releases = [(year, yearRows(values, newValues, year)) for year in yearsToPublish(openingList)]
+    
+    if written is not None:
+        releases = [(year, (rowIndexes, written.track(str(name) + " " + str(year), values.keys(), rowIndexes, rows))) for year, (rowIndexes, rows) in releases]
+    
+    return [(year, rows) for year, (rowIndexes, rows) in releases if len(rowIndexes) > 0]
 
-    wb = Workbook()
-    newSheet = wb.active
+def writePieceReleases(filename, headings, releases, outputFormat="xlsx", written=None):
+    ''' write all the releases of a piece to one file in the pieces folder, a sheet or Release Year value for each year, and return its name '''
+    if len(releases) == 0:
+        return None
     
-    col = 1
+    os.makedirs(directory('output', 'pieces'), exist_ok=True)
+    newFile = directory('output', 'pieces', os.path.splitext(os.path.basename(filename))[0] + outputExtension(filename, outputFormat))
     
-    for title, column in values.items():
-        newSheet.cell(1, col, title).font = Font(bold=True)
-        row = 2
-        for row_value in column:
-            newSheet.cell(row, col, row_value)
-            row+=1    
-        col+=1 
+    if outputFormat != "xlsx":
+        rowCount = writeRows(newFile, ["Release Year"] + list(headings), ([year] + list(row) for year, rows in releases for row in rows), outputFormat, ["Release Year"])
+        if written is not None:
+            written.wroteTogether(newFile, [os.path.basename(filename) + " " + str(year) for year, rows in releases], rowCount)
+        return newFile
+    
+    from openpyxl import Workbook
+    
+    wb = Workbook(write_only=True)
+    
+    for year, rows in releases:
+        ws = wb.create_sheet(str(year))
+        ws.append([boldCell(ws, heading) for heading in headings])
+        rowCount = 0
+        
+        for row in rows:
+            ws.append(row)
+            rowCount += 1
+        
+        if written is not None:
+            written.wrote(os.path.basename(filename) + " " + str(year), rowCount)
+    
+    wb.save(newFile + '.tmp')
+    os.replace(newFile + '.tmp', newFile)
+    return newFile
+
+class ReleaseWriter:
+    ''' Writes one file for each year with the rows of every piece released in it, release_<year> in the releases folder '''
+    
+    # the number of rows of a parquet release file held in memory before they are written out as a row group
+    rowGroupSize = 65536
+    
+    def __init__(self, outputFormat="xlsx"):
+        self.outputFormat = outputFormat
+        self.headings = None
+        self.releases = {}
+    
+    def add(self, release):
+        ''' add the rows of a piece from the release in its processFile result '''
+        if self.headings is None:
+            self.headings = release["headings"]
+        
+        positions = [release["headings"].index(heading) if heading in release["headings"] else None for heading in self.headings]
+        
+        for year, rows in release["years"]:
+            if year not in self.releases:
+                self.releases[year] = self.start(year)
+            
+            for row in rows:
+                self.releases[year]["append"]([row[position] if position is not None and position < len(row) else None for position in positions])
+            
+            if "parquetWriter" in self.releases[year] and len(self.releases[year]["rows"]) >= self.rowGroupSize:
+                self.writeRowGroup(self.releases[year])
+    
+    def start(self, year):
+        newFile = directory('output', 'releases', "release_" + str(year) + "." + self.outputFormat)
+        os.makedirs(os.path.dirname(newFile), exist_ok=True)
+        
+        if self.outputFormat == "csv":
+            csvFile = open(newFile + '.tmp', 'w', newline='', encoding='utf-8')
+            writer = csv.writer(csvFile)
+            writer.writerow(self.headings)
+            return {"file": newFile, "csvFile": csvFile, "append": writer.writerow}
+        
+        if self.outputFormat == "parquet":
+            if optionalModule("pyarrow") is None:
+                raise ImportError("parquet output needs pyarrow to be installed")
+            
+            pq = importlib.import_module("pyarrow.parquet")
+            schema = parquetSchema(self.headings)
+            rows = []
+            return {"file": newFile, "rows": rows, "append": rows.append, "schema": schema, "parquetWriter": pq.ParquetWriter(newFile + '.tmp', schema)}
+        
+        from openpyxl import Workbook
+        
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(str(year))
+        ws.append([boldCell(ws, heading) for heading in self.headings])
+        return {"file": newFile, "workbook": wb, "append": ws.append}
     
-    #print("Last cel written for " + str(year) + " x:" + str(row) + ", y: " + str(col))
-    if row > 2:   
+    def writeRowGroup(self, release):
+        ''' write the rows held for a parquet release file out as a row group and let them go '''
+        pa = optionalModule("pyarrow")
+        
+        if len(release["rows"]) > 0:
+            columns = zip(*release["rows"])
+            release["parquetWriter"].write_table(pa.table([arrowColumn(column, field.type) for column, field in zip(columns, release["schema"])], schema=release["schema"]))
+            release["rows"].clear()
+    
+    def close(self):
+        ''' finish writing the release files and return their names in order of year '''
+        for year, release in sorted(self.releases.items()):
+            if "csvFile" in release:
+                release["csvFile"].close()
+                os.replace(release["file"] + '.tmp', release["file"])
+            elif "parquetWriter" in release:
+                self.writeRowGroup(release)
+                release["parquetWriter"].close()
+                os.replace(release["file"] + '.tmp', release["file"])
+            else:
+                release["workbook"].save(release["file"] + '.tmp')
+                os.replace(release["file"] + '.tmp', release["file"])
+        
+        return [release["file"] for year, release in sorted(self.releases.items())]
+    
+    def abandon(self):
+        ''' stop writing the release files after a failed run, leaving none of them behind '''
+        for release in self.releases.values():
+            if "csvFile" in release:
+                release["csvFile"].close()
+            elif "parquetWriter" in release:
+                release["parquetWriter"].close()
+            else:
+                release["workbook"].save(release["file"] + '.tmp')
+            
+            if os.path.exists(release["file"] + '.tmp'):
+                os.remove(release["file"] + '.tmp')
+        
+        self.releases = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, excType, excValue, traceback):
+        if excType is not None:
+            self.abandon()
+
+def spreadsheetNoRedactions(filename, values, outputFormat="xlsx", written=None):
+    ''' print out a new spreadsheet (or csv or parquet file) with the full text for all columns'''
+    
+    rowCount = max(map(len, values.values()), default=0)
+    if rowCount > 0:   
         path = pathToFile(date.today().year)  
-        newFilename = os.path.splitext(os.path.basename(filename))[0] + '_NoRedactions' + os.path.splitext(os.path.basename(filename))[1]
+        newFilename = os.path.splitext(os.path.basename(filename))[0] + '_NoRedactions' + outputExtension(filename, outputFormat)
         newFileFullPath = os.path.join(path, newFilename)  
-        wb.save(newFileFullPath) 
+        rows = zip_longest(*values.values())
+        if written is not None:
+            rows = written.track(newFileFullPath, values.keys(), range(rowCount), rows)
+        rowsWritten = writeRows(newFileFullPath, values.keys(), rows, outputFormat)
+        if written is not None:
+            written.wrote(newFileFullPath, rowsWritten)
         return newFileFullPath 
 
-def generateSpreadsheets(filename, values, newValues, openingList):
-    ''' Create the spreadsheets for each year '''
+def generateSpreadsheets(filename, values, newValues, openingList, outputFormat="xlsx", written=None):
+    ''' Create the spreadsheets (or csv or parquet files) for each year and return a list of the files written '''
     yearsToPublishList = yearsToPublish(openingList)
+    newFiles = []
     
     for currentYear in yearsToPublishList:
-        unredactByYear(filename, values, newValues, currentYear)
+        newFile = unredactByYear(filename, values, newValues, currentYear, outputFormat=outputFormat, written=written)
+        if newFile is not None:
+            newFiles.append(newFile)
+    
+    return newFiles
+
+summaryHeadings = ["Item", "Age", "Covering Dates", "Opening Year", "Opening Note"]
+# the opening year is '?' where none was found, so only these are whole numbers in a csv or parquet summary
+summaryIntegerHeadings = ["Item", "Age", "Covering Dates"]
 
 def generateSummary(filename, ageList, coveringDatesList, openingListByPiece, openingListByExtractedDate, changesToOpening, full=False):
-    ''' print out a summary spreadsheet, including covering dates comparison outcome, with information about each piece on a seperate tab '''
+    ''' return the summary of a piece, including covering dates comparison outcome, as a sheet title and a list of rows for writeSummary '''
 
-    if os.path.exists(os.path.join('data', 'summary', 'summary.xlsx')):
-        wb = load_workbook(os.path.join('data', 'summary', 'summary.xlsx'))
-        ws = wb.create_sheet()
-    else:
-        wb = Workbook()        
-        ws = wb.active
+    title = filename
+    rows = []
+    
+    for item, (age, coveringDate, openingByPiece, openingByExtractedDate, changeToOpening) in enumerate(zip(ageList, coveringDatesList, openingListByPiece, openingListByExtractedDate, changesToOpening), 1):
+        note = None
         
-    ws.title = filename
-    colHeadings = ["Item", "Age", "Covering Dates", "Opening Year", "Opening Note"]
+        if openingByExtractedDate != '?' and openingByPiece <= date.today().year and openingByExtractedDate <= date.today().year and full:
+            note = "Difference in opening date irrelevant because both before current year. " + changeToOpening
+        elif openingByExtractedDate != '?' and openingByExtractedDate < openingByPiece and full:
+            note = "Date in description earlier than supplied covering date. Earlier date of " + str(openingByExtractedDate) + " used. " + changeToOpening
+            if '!' not in title:
+                title += '!'
+        elif openingByExtractedDate != '?' and openingByExtractedDate > openingByPiece:
+            note = "Date in description later than supplied covering date. Later date of " + str(openingByExtractedDate) + " used. Covering date should be checked! " + changeToOpening
+            if '!' not in title:
+                title += '!'
+        elif changeToOpening != "":
+            note = changeToOpening
+        elif openingByExtractedDate == '?':
+            note = "No opening date found"
+
+        rows.append([item, age, coveringDate, openingByExtractedDate, note])
+            
+    return (title, rows)
+
+def writeSummary(summarySheets, filename=None, outputFormat="xlsx"):
+    ''' print out a summary spreadsheet with information about each piece on a seperate tab, or a csv or parquet file for each piece '''
+    from openpyxl import Workbook
     
-    col = 1
-    count = 1
+    if filename is None:
+        filename = directory('summary', 'summary.xlsx')
     
-    for heading in colHeadings:
-        row = 2
-        ws.cell(1, col, heading).font = Font(bold=True)
-        
-        for age, coveringDate, openingByPiece, openingByExtractedDate, changeToOpening in zip(ageList, coveringDatesList, openingListByPiece, openingListByExtractedDate, changesToOpening):
-            ws.cell(row, 1, row-1)
-            ws.cell(row, 2, age)
-            ws.cell(row, 3, coveringDate)
-            ws.cell(row, 4, openingByExtractedDate)
-            if openingByExtractedDate != '?' and openingByPiece <= date.today().year and openingByExtractedDate <= date.today().year and full:
-                ws.cell(row, 5, "Difference in opening date irrelevant because both before current year. " + changeToOpening)
-            elif openingByExtractedDate != '?' and openingByExtractedDate < openingByPiece and full:
-                ws.cell(row, 5, "Date in description earlier than supplied covering date. Earlier date of " + str(openingByExtractedDate) + " used. " + changeToOpening)
-                if '!' not in ws.title:
-                    ws.title += '!'
-            elif openingByExtractedDate != '?' and openingByExtractedDate > openingByPiece:
-                ws.cell(row, 5, "Date in description later than supplied covering date. Later date of " + str(openingByExtractedDate) + " used. Covering date should be checked! " + changeToOpening)
-                if '!' not in ws.title:
-                    ws.title += '!'
-            elif changeToOpening != "":
-                ws.cell(row, 5, changeToOpening)
-            elif openingByExtractedDate == '?':
-                ws.cell(row, 5, "No opening date found")
-
-            row += 1
-            
-        col += 1
-            
-    wb.save(os.path.join('data', 'summary', 'summary.xlsx'))       
+    if outputFormat != "xlsx":
+        summaryFolder = os.path.splitext(filename)[0]
+        
+        if os.path.exists(summaryFolder):
+            for oldFile in list(Path(summaryFolder).glob("*.csv")) + list(Path(summaryFolder).glob("*.parquet")):
+                os.remove(oldFile)
+        
+        if len(summarySheets) > 0:
+            os.makedirs(summaryFolder, exist_ok=True)
+        
+        for title, rows in summarySheets:
+            writeRows(os.path.join(summaryFolder, title + "." + outputFormat), summaryHeadings, rows, outputFormat, summaryIntegerHeadings)
+        return
+    
+    if len(summarySheets) == 0:
+        return
     
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    
+    wb = Workbook(write_only=True)
+    
+    for title, rows in summarySheets:
+        ws = wb.create_sheet(title)
+        ws.append([boldCell(ws, heading) for heading in summaryHeadings])
         
+        for row in rows:
+            ws.append(row)
+            
+    wb.save(filename + '.tmp')
+    os.replace(filename + '.tmp', filename)
+
+def boldCell(ws, value):
+    ''' return a cell with bold text for appending to a write-only worksheet '''
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    
+    cell = WriteOnlyCell(ws, value)
+    cell.font = Font(bold=True)
+    return cell
+    
+
 def getFileList(myDir):
     ''' Get a list of xlsx files in the given directory '''
     return [file for file in myDir.glob("[!~.]*.xlsx")]
 
-def generateFiles(coveringDateFile='',reset=True,output=True,summary=True):
-    ''' Main program. Expects spreadsheets to be in the data directory.'''
+class Profiler:
+    ''' Records the wall time, CPU time and peak memory of each stage of processing a file, using tracemalloc if enabled '''
     
-    if reset and os.path.exists(os.path.join('data', 'converted')):        
-        shutil.rmtree(os.path.join('data', 'converted'))
-        os.makedirs(os.path.join('data', 'converted'))
+    def __init__(self, file, enabled=True):
+        self.file = file
+        self.enabled = enabled
+        self.records = []
         
-    if summary:
-        if os.path.exists(os.path.join('data', 'summary', 'summary.xlsx')):
-            os.remove(os.path.join('data', 'summary', 'summary.xlsx'))
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
     
-    for file in getFileList(Path('data')):
-        print("Processing " + os.path.basename(file))
-        currentSpreadsheet = getSpreadsheetValues(file)
-        #print(currentSpreadsheet.keys())
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
         
-        try:        
-            test_load_file(list(currentSpreadsheet.keys()))
+        tracemalloc.reset_peak()
+        startMemory = tracemalloc.get_traced_memory()[0]
+        startWall = time.perf_counter()
+        startCpu = time.process_time()
         
-            ageList = getAgeFromColumn(currentSpreadsheet['Age'])
-            test_all_ints(ageList)
+        try:
+            yield
+        finally:
+            self.records.append({"file": self.file, "stage": name, "pid": os.getpid(), 
+                "wall": time.perf_counter() - startWall, "cpu": time.process_time() - startCpu, 
+                "peakMemory": tracemalloc.get_traced_memory()[1] - startMemory})
+
+def writeProfileReport(records, profileDirectory=None):
+    ''' write the profile records, with totals by file and by stage, to profile.json and the records to profile.csv in the given directory (profile in the data directory by default). Returns the json file name '''
+    if profileDirectory is None:
+        profileDirectory = directory('data', 'profile')
+    
+    os.makedirs(profileDirectory, exist_ok=True)
+    profileFields = ["file", "stage", "pid", "wall", "cpu", "peakMemory"]
+    
+    def totals(key):
+        grouped = {}
+        for record in records:
+            total = grouped.setdefault(record[key], {"wall": 0, "cpu": 0, "peakMemory": 0})
+            total["wall"] += record["wall"]
+            total["cpu"] += record["cpu"]
+            total["peakMemory"] = max(total["peakMemory"], record["peakMemory"])
+        return grouped
+    
+    with open(os.path.join(profileDirectory, 'profile.json'), 'w') as profileFile:
+        json.dump({"byFile": totals("file"), "byStage": totals("stage"), "records": records}, profileFile, indent=1)
+    
+    with open(os.path.join(profileDirectory, 'profile.csv'), 'w', newline='') as profileFile:
+        writer = csv.DictWriter(profileFile, fieldnames=profileFields)
+        writer.writeheader()
+        writer.writerows(records)
+    
+    return os.path.join(profileDirectory, 'profile.json')
 
-            if '.' in coveringDateFile:
-                #filename = os.path.splitext(os.path.basename(file))[0]
-                piece = os.path.splitext(os.path.basename(file))[0].split('_')[1]
-                getCoveringDatesbyPieceDict = getCoveringDatesbyPiece(coveringDateFile)
+class RunOptions:
+    ''' The options of a run, passed to each stage of processing the spreadsheets instead of a parameter for each '''
+    
+    # the options recorded in the journal, which a resumed run carries on with
+    journalled = ["output", "summary", "incremental", "engine", "dateWindow", "outputFormat", "layout"]
+    
+    def __init__(self, output=True, summary=True, workers=1, incremental=False, engine="python", dateWindow=(1935, 1946), profile=False, verifyEvery=0, pipeline=None, outputFormat="xlsx", layout="year"):
+        self.output = output
+        self.summary = summary
+        self.workers = workers
+        self.incremental = incremental
+        self.engine = engine
+        self.dateWindow = tuple(dateWindow)
+        self.profile = profile
+        self.verifyEvery = verifyEvery
+        self.pipeline = tuple(pipeline) if pipeline is not None else None
+        self.outputFormat = outputFormat
+        self.layout = layout
+    
+    def journal(self):
+        ''' return the options to record in the journal '''
+        return {name: getattr(self, name) for name in self.journalled}
+    
+    def resumed(self, journal):
+        ''' return the options in the journal of an unfinished run, run with the workers, profiling, checks and pipeline of these '''
+        return RunOptions(workers=self.workers, profile=self.profile, verifyEvery=self.verifyEvery, pipeline=self.pipeline, **{name: journal[name] for name in self.journalled if name in journal})
+    
+    def manifestDetails(self):
+        ''' return the options recorded against each file processed in the manifest '''
+        return {"output": self.output, "format": self.outputFormat, "layout": self.layout, "dateWindow": list(self.dateWindow)}
+
+def processFile(file, coveringDatebyPiece='', options=None, roundTrip=False):
+    ''' Process a single spreadsheet from the data directory, here or in a worker process, and return a dict of its log lines, summary, outputs, error and profile '''
+    if options is None:
+        options = RunOptions()
+    
+    piece = readPiece(file, options.output, options.profile)
+    computePiece(piece, coveringDatebyPiece, options)
+    return writePiece(piece, options, roundTrip)
 
-                coveringDatebyPiece = ""
-                if len(getCoveringDatesbyPieceDict) > 0:
-                    coveringDatebyPiece = getCoveringDatesbyPieceDict[int(piece)]
+def readPiece(file, output=True, profile=False):
+    ''' First stage of processFile: load the spreadsheet and return the state of the piece passed on to computePiece and writePiece '''
+    
+    profiler = Profiler(os.path.basename(file), profile)
+    result = {"file": os.path.basename(file), "log": [], "summary": None, "outputs": [], "error": None, "profile": profiler.records, "index": []}
+    
+    result["log"].append("Processing " + os.path.basename(file))
+    # only the columns needed for the summary are loaded if no spreadsheets are output
+    with profiler.stage("load"):
+        headings, currentSpreadsheet = getSpreadsheetColumns(file, None if output else requiredColumns)
+    #print(currentSpreadsheet.keys())
+    
+    return {"file": file, "profiler": profiler, "result": result, "headings": headings, "values": currentSpreadsheet, "lists": None, "engine": "python"}
 
-        
-            dates = getYearFromColumn(currentSpreadsheet['Brief summary of grounds for recommendation'], coveringDatebyPiece)        
-                
-            yearList = []
-            coveringDatesList = []
-            coveringDatesByPieceList = []
+def computePiece(piece, coveringDatebyPiece='', options=None):
+    ''' Second stage of processFile: check the spreadsheet and work out the dates and opening years, recording any issue in the result '''
+    
+    file, profiler, result, headings, currentSpreadsheet = piece["file"], piece["profiler"], piece["result"], piece["headings"], piece["values"]
+    log = result["log"]
+    
+    if options is None:
+        options = RunOptions()
+    
+    engine, dateWindow = options.engine, options.dateWindow
+    # writePiece checks and groups the opening years with the same engine
+    piece["engine"] = engine
+    
+    try:        
+        test_load_file(headings)
+    
+        with profiler.stage("dates"):
+            ageList = getAgeFromColumn(currentSpreadsheet['Age'])
+            test_all_ints(ageList)
+
+            test_covering_date_found(coveringDatebyPiece, file)
+    
+            dates = getYearFromColumn(currentSpreadsheet['Brief summary of grounds for recommendation'], coveringDatebyPiece, dateWindow)        
+            
+            # the years are kept as compact columns, and the covering date of the piece just once
+            yearList = CompactColumn()
+            coveringDatesList = CompactColumn()
 
             for parts in dates:
                 #print(parts)
                 yearList.append(parts[0])
                 coveringDatesList.append(parts[1])
-                coveringDatesByPieceList.append(coveringDatebyPiece)
-
-            '''
-            if yearList != coveringDatesByPieceList:
-                print("Possibly anomologus dates in spreadsheet found (expected " + str(coveringDatebyPiece) + "): ", end="")
-                otherYears = set(coveringDatesList)
-                if coveringDatebyPiece in otherYears:
-                    otherYears.remove(coveringDatebyPiece)
-                print(otherYears)
-            '''                
             
-            insertCoveringDateValues(currentSpreadsheet, coveringDatesByPieceList)
-            print("Adding covering dates for " + os.path.basename(file))
+            coveringDatesByPieceList = CompactColumn(repeat(coveringDatebyPiece, len(yearList))).compact()
+
+        '''
+        if yearList != coveringDatesByPieceList:
+            print("Possibly anomologus dates in spreadsheet found (expected " + str(coveringDatebyPiece) + "): ", end="")
+            otherYears = set(coveringDatesList)
+            if coveringDatebyPiece in otherYears:
+                otherYears.remove(coveringDatebyPiece)
+            print(otherYears)
+        '''                
+        
+        insertCoveringDateValues(currentSpreadsheet, coveringDatesByPieceList)
+        log.append("Adding covering dates for " + os.path.basename(file))
 
-            originalOpeningListByPiece = createOpeningList(ageList, coveringDatesByPieceList)
-            originalOpeningListByExtractedDate = createOpeningList(ageList, yearList)
+        with profiler.stage("opening"):
+            createOpening, unredactDeceased = openingEngines[engine][:2]
+        
+            originalOpeningListByPiece = asCompactColumn(createOpening(ageList, coveringDatesByPieceList))
+            originalOpeningListByExtractedDate = asCompactColumn(createOpening(ageList, yearList))
 
             additionalInfoList = currentSpreadsheet['Additional Information']
 
-            openingListByPiece = unredactIfDeceased(originalOpeningListByPiece, additionalInfoList)
-            openingListByExtractedDate = unredactIfDeceased(originalOpeningListByExtractedDate, additionalInfoList)
+            openingListByPiece = asCompactColumn(unredactDeceased(originalOpeningListByPiece, additionalInfoList))
+            openingListByExtractedDate = asCompactColumn(unredactDeceased(originalOpeningListByExtractedDate, additionalInfoList))
 
             changesToOpening = test_unredaction_due_to_death(originalOpeningListByExtractedDate, openingListByExtractedDate, additionalInfoList)
-            #print(changesToOpening)
-            '''
-            combinedLists = zip(openingList, altOpeningList)
+        #print(changesToOpening)
+        '''
+        combinedLists = zip(openingList, altOpeningList)
+
+        row = 2
+        for default, byRow in combinedLists:        
+            if default > byRow and byRow > 2022:
+                print("Row " + str(row) + ": Opening date is " + str(default) + " but earlier date of " + str(byRow) + " might be possible")
+            row += 1
+        '''
+
+        test_all_ints(openingListByExtractedDate)
+        
+    except AssertionError as e:
+        log.append("Issue with " + os.path.basename(file) + " skipping")
+        log.append(str(e))
+        result["error"] = str(e)
+        return piece
+    
+    piece["lists"] = (ageList, coveringDatesByPieceList, openingListByPiece, openingListByExtractedDate, changesToOpening)
+    result["index"] = openingIndexRows(file, currentSpreadsheet['Item'], ageList, yearList, coveringDatebyPiece, openingListByExtractedDate, additionalInfoList)
+    return piece
+
+def writePiece(piece, options=None, roundTrip=False):
+    ''' Last stage of processFile: write out the files for the layout, check them and summarise the piece. Returns the result of processFile '''
+    
+    file, profiler, result, currentSpreadsheet = piece["file"], piece["profiler"], piece["result"], piece["values"]
+    log = result["log"]
+    
+    if options is None:
+        options = RunOptions()
+    
+    output, summary, dateWindow, outputFormat, layout = options.output, options.summary, options.dateWindow, options.outputFormat, options.layout
+    
+    if result["error"] is not None:
+        return result
+    
+    ageList, coveringDatesByPieceList, openingListByPiece, openingListByExtractedDate, changesToOpening = piece["lists"]
+    redactionNeededCheck, groupRows = openingEngines[piece["engine"]][2:]
+    written = WrittenRows()
+
+    if output:
+        if(redactionNeededCheck(openingListByExtractedDate)):
+            with profiler.stage("redact"):
+                newColumnValues = redactColumns(dict((key, currentSpreadsheet[key]) for key in ['Occupation', 'Brief summary of grounds for recommendation']), openingListByExtractedDate, dateWindow[1], groupRows=groupRows)
+            
+            with profiler.stage("write"):
+                if layout == "year":
+                    result["outputs"] = generateSpreadsheets(os.path.basename(file), currentSpreadsheet, newColumnValues, openingListByExtractedDate, outputFormat, written)
+                else:
+                    writeReleases(result, file, currentSpreadsheet, releasesByYear(currentSpreadsheet, newColumnValues, openingListByExtractedDate, written, os.path.basename(file)), outputFormat, layout, written)
+            
+            newFilename = os.path.splitext(os.path.basename(file))[0] + "_" + str(date.today().year) + outputExtension(file, outputFormat)
+            pathToNewFile = os.path.join(pathToFile(date.today().year), newFilename) if layout == "year" else None
+
+            log.append(os.path.basename(file) + " redacted. Spreadsheets with redacted descriptions and unredactions generated.")
+        else:
+            pathToNewFile = None
+            with profiler.stage("write"):
+                if layout == "year":
+                    pathToNewFile = spreadsheetNoRedactions(os.path.basename(file), currentSpreadsheet, outputFormat, written)
+                    result["outputs"] = [pathToNewFile] if pathToNewFile is not None else []
+                else:
+                    writeReleases(result, file, currentSpreadsheet, releasesByYear(currentSpreadsheet, written=written, name=os.path.basename(file)), outputFormat, layout, written)
 
-            row = 2
-            for default, byRow in combinedLists:        
-                if default > byRow and byRow > 2022:
-                    print("Row " + str(row) + ": Opening date is " + str(default) + " but earlier date of " + str(byRow) + " might be possible")
-                row += 1
             '''
+            filename = os.path.splitext(os.path.basename(file))[0] + '_NoRedactions' + os.path.splitext(os.path.basename(file))[1]
+            
+            try: 
+                shutil.copyfile(file, os.path.join(path, filename))
+            except shutil.SameFileError:
+                pass
+            '''
+
+            log.append(os.path.basename(file) + " copied over, no redactions needed")
 
-            test_all_ints(openingListByExtractedDate)
+        with profiler.stage("verify"):
+            itemsOnLoad = removeBlanksFromColumn(currentSpreadsheet['Item'])
             
-        except AssertionError as e:
-            print("Issue with " + os.path.basename(file) + " skipping")
-            print(e)
-            continue
-        
+            # each output is checked against the rows that were handed to its writer as they went by
+            for outputRows in written.outputs.values():
+                test_output_items(itemsOnLoad, list(currentSpreadsheet.keys()), removeBlanksFromColumn(outputRows["items"]))
+                test_output_rows(outputRows, currentSpreadsheet['Item'])
+            for outputFile in written.files.values():
+                test_output_file_rows(outputFile, written.outputs)
+            
+            # re-reading the spreadsheet that was written is only done when asked for, and only spreadsheets can be read back in
+            if roundTrip and pathToNewFile is not None and outputFormat == "xlsx":
+                test_load_file_row_count(itemsOnLoad, pathToNewFile)
+
+
+    if summary:   
+        with profiler.stage("summary"):
+            result["summary"] = generateSummary(os.path.splitext(os.path.basename(file))[0], ageList, coveringDatesByPieceList, openingListByPiece, openingListByExtractedDate, changesToOpening)
+    
+    return result
+
+def validatePiece(file, coveringDatebyPiece='', options=None):
+    ''' Check a spreadsheet and work out its opening years without writing anything, and return a report of any issue and the rows dated after the covering date '''
     
-        if output:
-            if(sheetRedactionNeededCheck(openingListByExtractedDate)):
-                newColumnValues = redactColumns(dict((key, currentSpreadsheet[key]) for key in ['Occupation', 'Brief summary of grounds for recommendation']), openingListByExtractedDate, 1946)
-                generateSpreadsheets(os.path.basename(file), currentSpreadsheet, newColumnValues, openingListByExtractedDate)
+    report = {"file": os.path.basename(file), "coveringDate": coveringDatebyPiece, "rows": 0, "error": None, "laterThanCoveringDate": []}
+    
+    # an error that would stop a full run is reported against the file like a failed check
+    try:
+        piece = computePiece(readPiece(file, output=False), coveringDatebyPiece, options)
+    except Exception as e:
+        report["error"] = repr(e)
+        return report
+    
+    report["error"] = piece["result"]["error"]
+    
+    if piece["lists"] is not None:
+        ageList, coveringDatesByPieceList, openingListByPiece, openingListByExtractedDate, changesToOpening = piece["lists"]
+        report["rows"] = len(openingListByExtractedDate)
+        # the same check as generateSummary, numbered by row in the same way
+        report["laterThanCoveringDate"] = [row for row, (openingByPiece, openingByExtractedDate) in enumerate(zip(openingListByPiece, openingListByExtractedDate), 1) 
+            if openingByExtractedDate != '?' and openingByExtractedDate > openingByPiece]
+    
+    return report
+
+def validateFiles(coveringDateFile='', options=None, **settings):
+    ''' Check every spreadsheet in the data directory with validatePiece, run with the RunOptions given or made from the settings, and return a report '''
+    if options is None:
+        options = RunOptions(**settings)
+    
+    checkEngine(options.engine)
+    
+    with redirect_stdout(sys.stderr):
+        coveringDates = getCoveringDatesbyPiece(coveringDateFile) if '.' in coveringDateFile else {}
+    
+    fileList = getFileList(Path(directory('data')))
+    coveringDateList = [getCoveringDateForFile(file, coveringDates) for file in fileList]
+    
+    if options.workers > 1:
+        with ProcessPoolExecutor(max_workers=options.workers, initializer=configureDirectories, initargs=(dataDirectories["data"], dataDirectories["output"], dataDirectories["lib"], dataDirectories["summary"])) as executor:
+            files = list(executor.map(validatePiece, fileList, coveringDateList, repeat(options)))
+    else:
+        files = [validatePiece(file, coveringDate, options) for file, coveringDate in zip(fileList, coveringDateList)]
+    
+    return {"files": files, "failed": [report["file"] for report in files if report["error"] is not None], 
+        "laterThanCoveringDate": [report["file"] for report in files if len(report["laterThanCoveringDate"]) > 0]}
+
+def writeReleases(result, file, values, releases, outputFormat="xlsx", layout="piece", written=None):
+    ''' write the releases of a piece to its own file for the piece layout, or keep their rows in the result for the release layout '''
+    if layout == "piece":
+        newFile = writePieceReleases(os.path.basename(file), values.keys(), releases, outputFormat, written)
+        result["outputs"] = [newFile] if newFile is not None else []
+    else:
+        result["release"] = {"headings": list(values.keys()), "years": [(year, [list(row) for row in rows]) for year, rows in releases]}
+
+def processFiles(fileList, coveringDateList, options):
+    ''' Process each file in the list with its covering date, in worker processes or the pipeline as the options say, and yield the results in the order of the list '''
+    roundTripList = [options.verifyEvery > 0 and index % options.verifyEvery == 0 for index in range(len(fileList))]
+    
+    if options.pipeline is not None:
+        yield from pipelineFiles(fileList, coveringDateList, roundTripList, options)
+    elif options.workers > 1:
+        with ProcessPoolExecutor(max_workers=options.workers, initializer=configureDirectories, initargs=(dataDirectories["data"], dataDirectories["output"], dataDirectories["lib"], dataDirectories["summary"])) as executor:
+            yield from executor.map(processFile, fileList, coveringDateList, repeat(options), roundTripList)
+    else:
+        for file, coveringDate, roundTrip in zip(fileList, coveringDateList, roundTripList):
+            yield processFile(file, coveringDate, options, roundTrip)
+
+def pipelineFiles(fileList, coveringDateList, roundTripList, options):
+    ''' Read, work out and write the files in overlapping stages, in a reader thread, this thread and the writer threads of options.pipeline, and yield the results in order '''
+    
+    queueSize, writers = options.pipeline
+    readQueue = queue.Queue(maxsize=queueSize)
+    stopped = threading.Event()
+    
+    def put(item):
+        # the reader gives up once the files stop being taken off the queue, instead of waiting on a full queue for good
+        while not stopped.is_set():
+            try:
+                readQueue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def readFiles():
+        try:
+            for file in fileList:
+                if not put(readPiece(file, options.output, options.profile)):
+                    return
+        except BaseException as e:
+            put(e)
+        put(None)
+    
+    threading.Thread(target=readFiles, name="pipelineReader", daemon=True).start()
+    pending = deque()
+    
+    try:
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            for coveringDate, roundTrip in zip(coveringDateList, roundTripList):
+                piece = readQueue.get()
                 
-                newFilename = os.path.splitext(os.path.basename(file))[0] + "_" + str(date.today().year) + os.path.splitext(os.path.basename(file))[1]
-                pathToNewFile = os.path.join(pathToFile(date.today().year), newFilename)
+                if isinstance(piece, BaseException):
+                    raise piece
+                
+                computePiece(piece, coveringDate, options)
+                pending.append(executor.submit(writePiece, piece, options, roundTrip))
+                
+                if len(pending) >= queueSize:
+                    yield pending.popleft().result()
+            
+            while len(pending) > 0:
+                yield pending.popleft().result()
+    finally:
+        # if a piece fails, the reader is stopped and the pieces it read ahead are let go
+        stopped.set()
+        
+        while not readQueue.empty():
+            readQueue.get_nowait()
+
+def getPieceFromFilename(file):
+    ''' Get the piece number from a spreadsheet named <series>_<piece>.xlsx, or None if the name has no piece '''
+    parts = os.path.splitext(os.path.basename(file))[0].split('_')
+    
+    if len(parts) < 2:
+        return None
+    
+    return int(parts[1]) if parts[1].isnumeric() else parts[1]
+
+def hashFile(file):
+    ''' return the sha256 hash of the contents of a file '''
+    fileHash = hashlib.sha256()
+    
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            fileHash.update(chunk)
+    
+    return fileHash.hexdigest()
+
+def loadManifest(filename=None):
+    ''' return the manifest of processed files from the last run (manifest.json in the data directory by default), or an empty manifest if there is none '''
+    if filename is None:
+        filename = directory('data', 'manifest.json')
+    
+    if os.path.exists(filename):
+        with open(filename) as manifestFile:
+            return json.load(manifestFile)
+    
+    return {"files": {}}
 
-                print(os.path.basename(file) + " redacted. Spreadsheets with redacted descriptions and unredactions generated.")
+def saveManifest(manifest, filename=None):
+    ''' write the manifest by way of a temporary file, with the output directory recorded relative to the data directory '''
+    if filename is None:
+        filename = directory('data', 'manifest.json')
+    
+    manifest["outputDirectory"] = os.path.relpath(directory('output'), directory('data'))
+    
+    with open(filename + '.tmp', 'w') as manifestFile:
+        json.dump(manifest, manifestFile, indent=1)
+    
+    os.replace(filename + '.tmp', filename)
+
+def startJournal(options, filename=None):
+    ''' start the journal of a new run (journal.jsonl in the data directory by default) with the options it was run with, and return it open for appendJournal '''
+    if filename is None:
+        filename = directory('data', 'journal.jsonl')
+    
+    journal = open(filename, 'w')
+    appendJournal(journal, {"run": dict(options, started=date.today().isoformat())})
+    return journal
+
+def appendJournal(journal, record):
+    ''' add a record to the journal as a line of json, and make sure it is on disk before carrying on '''
+    journal.write(json.dumps(record) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+def loadJournal(filename=None):
+    ''' return the options of an unfinished run and the manifest entries of the files it completed by name, or None if there is no unfinished run '''
+    if filename is None:
+        filename = directory('data', 'journal.jsonl')
+    
+    if not os.path.exists(filename):
+        return None
+    
+    options = None
+    completed = {}
+    
+    with open(filename) as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            
+            if "run" in record:
+                options = record["run"]
             else:
-                path = pathToFile(date.today().year)
-                pathToNewFile = spreadsheetNoRedactions(os.path.basename(file), currentSpreadsheet)
+                completed[record["file"]] = record["entry"]
+    
+    return (options, completed) if options is not None else None
 
-                '''
-                filename = os.path.splitext(os.path.basename(file))[0] + '_NoRedactions' + os.path.splitext(os.path.basename(file))[1]
+def manifestEntry(file, coveringDate, previous=None, hashed=True):
+    ''' return the manifest details of an input file, hashing it only if hashed is set and its size or modification time changed '''
+    stat = os.stat(file)
+    entry = {"size": stat.st_size, "modified": stat.st_mtime, "coveringDate": coveringDate}
+    
+    if previous is not None and previous["size"] == entry["size"] and previous["modified"] == entry["modified"]:
+        entry["hash"] = previous["hash"]
+    else:
+        entry["hash"] = hashFile(file) if hashed else None
+    
+    return entry
+
+def unchangedSinceManifest(entry, previous, options):
+    ''' return True if the file was processed successfully this year with the same contents, covering date and options, and its outputs are still there '''
+    return (previous is not None and previous["error"] is None 
+        and previous["hash"] == entry["hash"] and previous["coveringDate"] == entry["coveringDate"]
+        and tuple(previous.get("dateWindow", (1935, 1946))) == options.dateWindow
+        and ((previous.get("format", "xlsx") == options.outputFormat and previous.get("layout", "year") == options.layout) or not options.output)
+        and previous["processed"][:4] == str(date.today().year)
+        and (previous["output"] or not options.output) and (previous["summary"] is not None or not options.summary)
+        and all(os.path.exists(newFile) for newFile in previous["outputs"]))
+
+def removeOutputs(outputs):
+    ''' delete the files generated for an input on a previous run '''
+    for newFile in outputs:
+        if os.path.exists(newFile):
+            os.remove(newFile)
+            
+            if len(os.listdir(os.path.dirname(newFile))) == 0:
+                os.rmdir(os.path.dirname(newFile))
+
+openingIndexColumns = ["file", "series", "piece", "item", "age", "extracted_year", "covering_date", "opening_year", "deceased"]
+
+def openingIndexRows(file, itemList, ageList, yearList, coveringDate, openingList, additionalInfoList):
+    ''' return a row for the opening index for each record of a piece, in the order of openingIndexColumns '''
+    series = os.path.splitext(os.path.basename(file))[0].split('_')[0]
+    piece = getPieceFromFilename(file)
+    
+    return [(os.path.basename(file), series, piece, item, age, year if isinstance(year, int) else None, coveringDate if isinstance(coveringDate, int) else None, 
+        openingYear, "Deceased" in additionalInfo) for item, age, year, openingYear, additionalInfo in zip(itemList, ageList, yearList, openingList, additionalInfoList)]
+
+def openIndex(filename=None):
+    ''' open the opening index of every record processed (opening_index.sqlite in the data directory by default), creating it if needed '''
+    if filename is None:
+        filename = directory('data', 'opening_index.sqlite')
+    
+    connection = sqlite3.connect(filename)
+    connection.row_factory = sqlite3.Row
+    connection.execute("CREATE TABLE IF NOT EXISTS items (file TEXT, series TEXT, piece, item, age INTEGER, extracted_year INTEGER, covering_date INTEGER, opening_year INTEGER, deceased INTEGER)")
+    connection.execute("CREATE INDEX IF NOT EXISTS items_opening_year ON items (opening_year)")
+    connection.execute("CREATE INDEX IF NOT EXISTS items_file ON items (file)")
+    return connection
+
+def updateIndex(connection, file, rows):
+    ''' replace the records of a file in the opening index '''
+    connection.execute("DELETE FROM items WHERE file = ?", (file,))
+    connection.executemany("INSERT INTO items VALUES (" + ", ".join("?" * len(openingIndexColumns)) + ")", rows)
+
+def queryOpeningYear(year, series=None, filename=None):
+    ''' return the records that open in the given year, optionally for just one series '''
+    with closing(openIndex(filename)) as connection:
+        if series is None:
+            return connection.execute("SELECT * FROM items WHERE opening_year = ? ORDER BY series, piece, item", (year,)).fetchall()
+        return connection.execute("SELECT * FROM items WHERE opening_year = ? AND series = ? ORDER BY piece, item", (year, series)).fetchall()
+
+def queryDatesAfterCoveringDate(filename=None):
+    ''' return the records with a date in the description later than the covering date of the piece, which should be checked '''
+    with closing(openIndex(filename)) as connection:
+        return connection.execute("SELECT * FROM items WHERE extracted_year > covering_date ORDER BY series, piece, item").fetchall()
+
+def printIndexRows(rows):
+    ''' print rows from the opening index as csv '''
+    writer = csv.writer(sys.stdout)
+    writer.writerow(openingIndexColumns)
+    writer.writerows(tuple(row) for row in rows)
+
+def generateFiles(coveringDateFile='', reset=True, options=None, resume=False, shard=None, **settings):
+    ''' Main program. Processes the spreadsheets in the data directory set with configureDirectories with the RunOptions given, or made from the settings '''
+    if options is None:
+        options = RunOptions(**settings)
+    
+    unfinished = loadJournal() if resume else None
+    
+    if options.layout == "release" and options.output and (options.incremental or shard is not None):
+        raise ValueError("release files are written from every piece, so cannot be written by an incremental or shard run")
+    
+    if options.profile and options.pipeline is not None:
+        raise ValueError("the stages of different spreadsheets overlap in the pipeline, so it cannot be profiled")
+    
+    if resume and unfinished is None:
+        print("No unfinished run to resume in " + directory('data'))
+        return
+    
+    if unfinished is not None and unfinished[0].get("layout", "year") == "release" and unfinished[0]["output"]:
+        print("The run writing release files cannot be resumed, as the rows already released are not kept. Starting it again")
+        return generateFiles(unfinished[0]["coveringDateFile"], reset=True, options=options.resumed(unfinished[0]))
+    
+    if unfinished is not None:
+        journalled, completed = unfinished
+        coveringDateFile, shard = journalled["coveringDateFile"], journalled.get("shard")
+        options = options.resumed(journalled)
+        print("Resuming the run started " + journalled["started"] + ", " + str(len(completed)) + " spreadsheets already done")
+    else:
+        completed = {}
+    
+    # the stages of the run as a whole are filed under "run", which no spreadsheet name can be as it has no extension
+    profiler = Profiler("run", options.profile)
+    checkEngine(options.engine)
+    
+    
+    # the shard is looked up before anything is cleared, so a missing plan or shard leaves the last run's output alone
+    shardFiles = getShardFiles(shard) if shard is not None else None
+    
+    if unfinished is None:
+        if reset and not options.incremental and os.path.exists(directory('output')):        
+            checkOutputDirectory()
+            shutil.rmtree(directory('output'))
+            os.makedirs(directory('output'))
+            
+        if options.summary:
+            if os.path.exists(directory('summary', 'summary.xlsx')):
+                os.remove(directory('summary', 'summary.xlsx'))
+    
+    with profiler.stage("coveringDates"):
+        previousManifest = loadManifest() if options.incremental else {"files": {}}
+        manifest = {"files": {}}
+        coveringDates = getCoveringDatesbyPiece(coveringDateFile) if '.' in coveringDateFile else {}
+    
+    fileList = getFileList(Path(directory('data')))
+    
+    if shard is not None:
+        missing = [name for name in shardFiles if name not in [os.path.basename(file) for file in fileList]]
+        
+        if len(missing) > 0:
+            print("Shard " + str(shard) + " spreadsheets not found in " + directory('data') + ": " + ", ".join(missing))
+        
+        fileList = [file for file in fileList if os.path.basename(file) in shardFiles]
+    
+    toProcess = []
+    coveringDateList = []
+    resumed = set()
+    
+    if len(coveringDates) > 0:
+        missing = [os.path.basename(file) for file in fileList if getCoveringDateForFile(file, coveringDates) is None]
+        if len(missing) > 0:
+            print("No covering date found for " + str(len(missing)) + " spreadsheets, these will be skipped: " + ", ".join(missing))
+    
+    for file in fileList:
+        previous = previousManifest["files"].get(os.path.basename(file))
+        # the files are only hashed when they are compared with an earlier run
+        entry = manifestEntry(file, getCoveringDateForFile(file, coveringDates), previous, options.incremental)
+        done = completed.get(os.path.basename(file))
+        
+        if done is not None and manifestEntry(file, entry["coveringDate"], done)["hash"] == done["hash"] and done["coveringDate"] == entry["coveringDate"]:
+            manifest["files"][os.path.basename(file)] = done
+            resumed.add(file)
+        elif unchangedSinceManifest(entry, previous, options):
+            manifest["files"][os.path.basename(file)] = previous
+        else:
+            if previous is not None:
+                removeOutputs(previous["outputs"])
+            manifest["files"][os.path.basename(file)] = entry
+            toProcess.append(file)
+            coveringDateList.append(entry["coveringDate"])
+    
+    index = openIndex()
+    
+    if not options.incremental and unfinished is None:
+        index.execute("DELETE FROM items")
+    
+    for name, previous in previousManifest["files"].items():
+        if name not in manifest["files"]:
+            removeOutputs(previous["outputs"])
+            updateIndex(index, name, [])
+    
+    index.commit()
+    
+    if unfinished is not None:
+        journal = open(directory('data', 'journal.jsonl'), 'a')
+    else:
+        journal = startJournal(dict(options.journal(), coveringDateFile=coveringDateFile, shard=shard))
+    
+    results = processFiles(toProcess, coveringDateList, options)
+    processing = set(toProcess)
+    summarySheets = []
+    releaseWriter = ReleaseWriter(options.outputFormat) if options.layout == "release" and options.output else None
+    
+    with journal, releaseWriter if releaseWriter is not None else nullcontext():
+        for file in fileList:
+            entry = manifest["files"][os.path.basename(file)]
+            
+            if file in processing:
+                result = next(results)
+                
+                for line in result["log"]:
+                    print(line)
                 
-                try: 
-                    shutil.copyfile(file, os.path.join(path, filename))
-                except shutil.SameFileError:
-                    pass
-                '''
+                entry.update(options.manifestDetails(), processed=date.today().isoformat(), outputs=result["outputs"], summary=result["summary"], error=result["error"])
+                profiler.records.extend(result["profile"])
+                
+                if releaseWriter is not None and "release" in result:
+                    releaseWriter.add(result.pop("release"))
+                updateIndex(index, result["file"], result["index"])
+                # the index is committed before the file is journalled, so a resumed run never misses its records
+                index.commit()
+                appendJournal(journal, {"file": os.path.basename(file), "entry": entry})
+            elif file in resumed:
+                print("Skipping " + os.path.basename(file) + ", already done before the run was resumed")
+            else:
+                print("Skipping " + os.path.basename(file) + ", unchanged since " + entry["processed"])
+
+            if options.summary and entry["summary"] is not None:
+                summarySheets.append(entry["summary"])
+    
+    if releaseWriter is not None:
+        with profiler.stage("writeReleases"):
+            manifest["releases"] = releaseWriter.close()
+        print(str(len(manifest["releases"])) + " release files written to " + directory('output', 'releases'))
+    
+    if options.summary:
+        with profiler.stage("writeSummary"):
+            writeSummary(summarySheets, outputFormat=options.outputFormat)
+    
+    index.commit()
+    index.close()
+    saveManifest(manifest)
+    os.remove(directory('data', 'journal.jsonl'))
+    
+    if options.profile:
+        print("Profile written to " + writeProfileReport(profiler.records))
 
-                print(os.path.basename(file) + " copied over, no redactions needed")
+def watchFiles(coveringDateFile='', options=None, interval=2.0, settle=2.0, polls=None, **settings):
+    ''' Process spreadsheets as they are added to or changed in the data directory, once unchanged for settle seconds, checking every interval seconds until interrupted '''
+    if options is None:
+        options = RunOptions(**settings)
+    
+    if options.layout == "release" and options.output:
+        raise ValueError("release files are written from every piece, so cannot be written while watching")
+    
+    checkEngine(options.engine)
+    manifest = loadManifest()
+    index = openIndex()
+    coveringDates = {}
+    coveringDatesModified = None
+    pending = {}
+    failed = {}
+    poll = 0
+    
+    print("Watching " + directory('data') + " for spreadsheets, press Ctrl+C to stop")
+    
+    try:
+        while polls is None or poll < polls:
+            if poll > 0:
+                time.sleep(interval)
+            poll += 1
+            
+            if '.' in coveringDateFile and os.path.exists(directory('lib', coveringDateFile)) and os.stat(directory('lib', coveringDateFile)).st_mtime != coveringDatesModified:
+                coveringDatesModified = os.stat(directory('lib', coveringDateFile)).st_mtime
+                coveringDates = getCoveringDatesbyPiece(coveringDateFile)
+            
+            fileList = getFileList(Path(directory('data')))
+            names = set(os.path.basename(file) for file in fileList)
+            changed = False
+            
+            for file in fileList:
+                name = os.path.basename(file)
+                stat = os.stat(file)
+                signature = (stat.st_size, stat.st_mtime)
+                coveringDate = getCoveringDateForFile(file, coveringDates)
+                previous = manifest["files"].get(name)
+                
+                if failed.get(name) == signature:
+                    continue
+                
+                # a piece that failed its checks is not tried again until it or the date window changes
+                if previous is not None and (previous["size"], previous["modified"]) == signature and previous["coveringDate"] == coveringDate and (
+                    (previous.get("error") is not None and tuple(previous.get("dateWindow", (1935, 1946))) == options.dateWindow) or unchangedSinceManifest(previous, previous, options)):
+                    pending.pop(name, None)
+                    continue
+                
+                if name not in pending or pending[name][0] != signature:
+                    pending[name] = (signature, time.time())
+                
+                if time.time() - pending[name][1] < settle:
+                    continue
+                
+                del pending[name]
+                entry = manifestEntry(file, coveringDate, previous)
+                
+                if unchangedSinceManifest(entry, previous, options):
+                    previous.update(size=entry["size"], modified=entry["modified"])
+                    changed = True
+                    continue
+                
+                try:
+                    result = processFile(file, coveringDate, options)
+                except Exception as e:
+                    print("Could not process " + name + ", it will be tried again when it changes: " + repr(e))
+                    failed[name] = signature
+                    continue
+                
+                failed.pop(name, None)
+                
+                for line in result["log"]:
+                    print(line)
+                
+                if previous is not None:
+                    removeOutputs([newFile for newFile in previous["outputs"] if newFile not in result["outputs"]])
+                
+                entry.update(options.manifestDetails(), processed=date.today().isoformat(), outputs=result["outputs"], summary=result["summary"], error=result["error"])
+                manifest["files"][name] = entry
+                updateIndex(index, name, result["index"])
+                changed = True
+            
+            for name in [name for name in manifest["files"] if name not in names]:
+                print("Removing the output for " + name)
+                removeOutputs(manifest["files"].pop(name)["outputs"])
+                updateIndex(index, name, [])
+                pending.pop(name, None)
+                failed.pop(name, None)
+                changed = True
+            
+            if changed:
+                if options.summary:
+                    summarySheets = [manifest["files"][os.path.basename(file)]["summary"] for file in fileList if manifest["files"].get(os.path.basename(file), {}).get("summary") is not None]
+                    
+                    if len(summarySheets) == 0 and os.path.exists(directory('summary', 'summary.xlsx')):
+                        os.remove(directory('summary', 'summary.xlsx'))
+                    
+                    writeSummary(summarySheets, outputFormat=options.outputFormat)
+                
+                index.commit()
+                saveManifest(manifest)
+    except KeyboardInterrupt:
+        print("Stopped watching " + directory('data'))
+    finally:
+        index.commit()
+        index.close()
+        saveManifest(manifest)
+
+def countRows(filename):
+    ''' return the number of rows in the first sheet of a spreadsheet, from the dimensions stored in the file if it has them '''
+    from openpyxl import load_workbook
+    
+    wb = load_workbook(filename, read_only=True)
+    
+    try:
+        ws = wb.worksheets[0]
+        return ws.max_row if ws.max_row is not None else sum(1 for row in ws.iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+def planShards(shards, filename=None):
+    ''' split the spreadsheets in the data directory into shards with about the same number of rows, write the plan to shards.json by default and return it '''
+    if shards < 1:
+        raise ValueError("the spreadsheets must be split into at least one shard, not " + str(shards))
+    
+    if filename is None:
+        filename = directory('data', 'shards.json')
+    
+    fileList = getFileList(Path(directory('data')))
+    rows = {os.path.basename(file): countRows(file) for file in fileList}
+    plan = {"order": [os.path.basename(file) for file in fileList], "shards": [{"shard": shard, "rows": 0, "files": []} for shard in range(shards)]}
+    
+    for name in sorted(rows, key=rows.get, reverse=True):
+        shard = min(plan["shards"], key=lambda shard: shard["rows"])
+        shard["files"].append(name)
+        shard["rows"] += rows[name]
+    
+    with open(filename + '.tmp', 'w') as planFile:
+        json.dump(plan, planFile, indent=1)
+    
+    os.replace(filename + '.tmp', filename)
+    return plan
 
-            test_load_file_row_count(removeBlanksFromColumn(currentSpreadsheet['Item']), pathToNewFile)
+def loadShardPlan(filename=None):
+    ''' return the plan written by planShards (shards.json in the data directory by default), raising ValueError if there is none '''
+    if filename is None:
+        filename = directory('data', 'shards.json')
+    
+    if not os.path.exists(filename):
+        raise ValueError("no shard plan found at " + filename + ", the spreadsheets must be planned into shards first")
+    
+    with open(filename) as planFile:
+        return json.load(planFile)
 
+def getShardFiles(shard, filename=None):
+    ''' return the spreadsheets in a shard of the plan, raising ValueError if the plan has no such shard '''
+    shards = loadShardPlan(filename)["shards"]
+    
+    if not 0 <= shard < len(shards):
+        raise ValueError("there is no shard " + str(shard) + " in the plan, its shards are 0 to " + str(len(shards) - 1))
+    
+    return shards[shard]["files"]
 
-        if summary:   
-            generateSummary(os.path.splitext(os.path.basename(file))[0], ageList, coveringDatesByPieceList, openingListByPiece, openingListByExtractedDate, changesToOpening)   
+def mergeShards(shardDirectories, plan=None):
+    ''' combine the output, summary, manifest and opening index of shard runs into the configured directories, as a single run would have written them '''
+    if plan is None:
+        plan = loadShardPlan()
+    
+    shards = []
+    
+    for shardDirectory in shardDirectories:
+        # a mistyped shard directory would otherwise be merged as an empty shard
+        if not os.path.isdir(shardDirectory):
+            raise ValueError("the shard directory " + shardDirectory + " does not exist")
+        
+        if not os.path.exists(os.path.join(shardDirectory, 'manifest.json')):
+            raise ValueError("no manifest found in " + shardDirectory + ", it is not the data directory of a finished shard run")
+        
+        shardManifest = loadManifest(os.path.join(shardDirectory, 'manifest.json'))
+        shardOutput = os.path.join(shardDirectory, shardManifest.get("outputDirectory", "converted"))
+        
+        if {os.path.realpath(shardDirectory), os.path.realpath(shardOutput)} & {os.path.realpath(directory('data')), os.path.realpath(directory('output'))}:
+            raise ValueError("cannot merge " + shardDirectory + " into itself, the shards must be merged into another data and output directory")
+        
+        shards.append((shardDirectory, shardManifest, shardOutput))
+    
+    manifest = {"files": {}}
+    outputFormat = "xlsx"
+    checkOutputDirectory()
+    
+    if os.path.exists(directory('output')):
+        shutil.rmtree(directory('output'))
+    os.makedirs(directory('output'))
+    
+    index = openIndex()
+    index.execute("DELETE FROM items")
+    index.commit()
+    
+    for shardDirectory, shardManifest, shardOutput in shards:
+        print("Merging " + shardDirectory)
+        
+        for name, entry in shardManifest["files"].items():
+            outputs = []
             
+            # each output is in a folder for its year (or pieces) in the output directory
+            for newFile in entry["outputs"]:
+                folder, fileName = os.path.basename(os.path.dirname(newFile)), os.path.basename(newFile)
+                outputs.append(os.path.join(pathToFile(folder), fileName))
+                shutil.copyfile(os.path.join(shardOutput, folder, fileName), outputs[-1])
+            
+            entry["outputs"] = outputs
+            outputFormat = entry.get("format", outputFormat)
+            manifest["files"][name] = entry
+        
+        if os.path.exists(os.path.join(shardDirectory, 'opening_index.sqlite')):
+            index.execute("ATTACH DATABASE ? AS shard", (os.path.join(shardDirectory, 'opening_index.sqlite'),))
+            index.execute("INSERT INTO items SELECT * FROM shard.items")
+            index.commit()
+            index.execute("DETACH DATABASE shard")
+    
+    index.close()
+    
+    missing = [name for name in plan["order"] if name not in manifest["files"]]
+    if len(missing) > 0:
+        print("No shard output found for " + str(len(missing)) + " spreadsheets: " + ", ".join(missing))
+    
+    if os.path.exists(directory('summary', 'summary.xlsx')):
+        os.remove(directory('summary', 'summary.xlsx'))
+    
+    writeSummary([manifest["files"][name]["summary"] for name in plan["order"] if name in manifest["files"] and manifest["files"][name]["summary"] is not None], outputFormat=outputFormat)
+    saveManifest(manifest)
 
       
         
@@ -435,17 +2014,38 @@ def generateFiles(coveringDateFile='',reset=True,output=True,summary=True):
 
 
 def test_load_file(columnHeadings):
-    expectedColumns = ['Letter','Series','Piece', 'Item', 'Treasury case number', 'Home Office case number', 'First names/Initials', 'Surname', 'Age', 'Occupation', 'Award granted', 'Brief summary of grounds for recommendation', 'Additional Information']   
+    expectedColumns = inputColumns   
     assert columnHeadings == expectedColumns, "Error in expected columns. Check for " + str([i for i in expectedColumns + columnHeadings if i not in expectedColumns or i not in columnHeadings])  
 
 def test_load_generated_file(columnHeadings):
-    expectedColumns = ['Letter','Series','Piece', 'Item', 'Treasury case number', 'Home Office case number', 'First names/Initials', 'Surname', 'Age', 'Occupation', 'Award granted', 'Brief summary of grounds for recommendation', 'Additional Information', 'Covering Dates']   
+    expectedColumns = inputColumns + ['Covering Dates']   
     assert columnHeadings == expectedColumns, "Error in expected columns. Check for " + str([i for i in expectedColumns + columnHeadings if i not in expectedColumns or i not in columnHeadings])  
 
+def test_output_items(item_column_on_load, columnHeadings, items_written):
+    test_load_generated_file(columnHeadings)
+    unexpectedItems = Counter(items_written) - Counter(item_column_on_load)
+    assert len(unexpectedItems) == 0, "Error in expected output. Unexpected items: " + str(list(unexpectedItems.elements()))
+
+def test_output_rows(outputRows, item_column_on_load):
+    for rowCount in (outputRows["rows"], outputRows["written"]):
+        if rowCount is not None:
+            assert rowCount == len(outputRows["rowIndexes"]), "Error in expected output. " + str(rowCount) + " rows written to " + outputRows["name"] + " but " + str(len(outputRows["rowIndexes"])) + " expected"
+    missingItems = Counter(item_column_on_load[index] for index in outputRows["rowIndexes"] if index < len(item_column_on_load)) - Counter(outputRows["items"])
+    assert len(missingItems) == 0, "Error in expected output. Missing items in " + outputRows["name"] + ": " + str(list(missingItems.elements()))
+
+def test_output_file_rows(outputFile, outputs):
+    expected = sum(len(outputs[name]["rowIndexes"]) for name in outputFile["names"])
+    assert outputFile["written"] == expected, "Error in expected output. " + str(outputFile["written"]) + " rows written to " + outputFile["file"] + " but " + str(expected) + " expected"
+
 def test_load_file_row_count(item_column_on_load, newFile):
-    newSpreadsheet = getSpreadsheetValues(newFile)
-    test_load_generated_file(list(newSpreadsheet.keys()))
-    assert all(item in item_column_on_load for item in removeBlanksFromColumn(newSpreadsheet['Item'])), "Error in expected output. Missing items: " + str([i for i in item_column_on_load if i not in newSpreadsheet['Item']])  
+    headings, newSpreadsheet = getSpreadsheetColumns(newFile, ['Item'])
+    test_load_generated_file(headings)
+    itemsOnLoad = set(item_column_on_load)
+    itemsInFile = set(newSpreadsheet['Item'])
+    assert all(item in itemsOnLoad for item in removeBlanksFromColumn(newSpreadsheet['Item'])), "Error in expected output. Missing items: " + str([i for i in item_column_on_load if i not in itemsInFile])  
+
+def test_covering_date_found(coveringDate, file):
+    assert coveringDate is not None, "Error in covering dates: no covering date found for piece " + str(getPieceFromFilename(file))
 
 def test_all_ints(list):
     assert all(isinstance(x, int) for x in list), "Error in expected data types: " + str(list)
@@ -541,13 +2141,107 @@ test_openingList_testFile(openingList)
 
 if(sheetRedactionNeededCheck(openingList)):
     newColumns = redactColumns(dict((key, currentSpreadsheet[key]) for key in ['Occupation', 'Brief summary of grounds for recommendation']), openingList, 1945)
-    #pp(newColumns)
     
 #generateSpreadsheets("test.xlsx", currentSpreadsheet, newColumns, openingList)
 
 test_unredactionDueToDeath()
 '''
 
-generateFiles('covering_dates.csv')
+def main():
+    parser = argparse.ArgumentParser(description="Redact personal details from catalogue spreadsheets in the data directory until they are over 100 years old")
+    parser.add_argument("coveringDateFile", nargs="?", default="covering_dates.csv", help="csv file of covering dates by piece in the lib directory")
+    parser.add_argument("--data", default="data", help="directory the spreadsheets are read from, which also holds the manifest, profile and opening index")
+    parser.add_argument("--output", help="directory the yearly output is written to, converted in the data directory by default")
+    parser.add_argument("--lib", help="directory of the covering dates file, lib in the data directory by default")
+    parser.add_argument("--summary", help="directory the summary is written to, summary in the data directory by default")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes used to process the spreadsheets")
+    parser.add_argument("--incremental", action="store_true", help="only process spreadsheets that have changed since the last run recorded in the manifest in the data directory")
+    parser.add_argument("--resume", action="store_true", help="carry on from the first unfinished spreadsheet of a run that stopped partway through, with the options it was started with")
+    parser.add_argument("--engine", choices=openingEngines.keys(), default="python", help="work out opening years with plain python or numpy arrays")
+    parser.add_argument("--profile", action="store_true", help="write the time and memory used by each stage for each spreadsheet to profile in the data directory, not with --pipeline")
+    parser.add_argument("--verify-every", type=int, default=0, metavar="N", help="read back in and check the output of every Nth spreadsheet, 1 checks them all")
+    parser.add_argument("--pipeline", action="store_true", help="overlap reading, working out and writing the spreadsheets in threads, instead of using --workers")
+    parser.add_argument("--queue-size", type=int, default=4, help="number of spreadsheets the pipeline holds between stages")
+    parser.add_argument("--writers", type=int, default=2, help="number of threads the pipeline writes spreadsheets with")
+    parser.add_argument("--format", choices=outputFormats, default="xlsx", help="write the yearly files and summary as spreadsheets, csv files or parquet files")
+    parser.add_argument("--layout", choices=outputLayouts, default="year", help="write a file for each piece for each year, one file for each piece with all its years, or one release file for each year with every piece")
+    parser.add_argument("--date-window", nargs=2, type=int, default=(1935, 1946), metavar=("EARLIEST", "LATEST"), help="years of the series that dates in descriptions must fall between")
+    parser.add_argument("--plan", type=int, metavar="SHARDS", help="split the spreadsheets into SHARDS shards with about the same number of rows and write the plan to shards.json in the data directory")
+    parser.add_argument("--shard", type=int, help="only process the spreadsheets in this shard of the plan")
+    parser.add_argument("--merge", nargs="+", metavar="SHARD_DATA", help="combine the data directories of shard runs into the output, summary, manifest and opening index")
+    parser.add_argument("--validate-only", action="store_true", help="only check the spreadsheets and work out their opening years, and print a json report of the issues found instead of writing anything")
+    parser.add_argument("--watch", action="store_true", help="keep running and process spreadsheets as they are added to or changed in the data directory")
+    parser.add_argument("--interval", type=float, default=2.0, metavar="SECONDS", help="how often --watch checks the data directory")
+    parser.add_argument("--settle", type=float, default=2.0, metavar="SECONDS", help="how long a spreadsheet must be unchanged before --watch processes it")
+    parser.add_argument("--opening-in", type=int, metavar="YEAR", help="print the records in the opening index that open in YEAR instead of processing the spreadsheets")
+    parser.add_argument("--after-covering-date", action="store_true", help="print the records in the opening index with a date later than the covering date instead of processing the spreadsheets")
+    args = parser.parse_args()
+    
+    configureDirectories(args.data, args.output, args.lib, args.summary)
+    
+    try:
+        checkOutputDirectory()
+    except ValueError as e:
+        parser.error(str(e))
+    
+    if args.opening_in is not None:
+        printIndexRows(queryOpeningYear(args.opening_in))
+        return
+    
+    if args.after_covering_date:
+        printIndexRows(queryDatesAfterCoveringDate())
+        return
+    
+    if args.plan is not None and args.plan < 1:
+        parser.error("--plan needs at least one shard")
+    
+    if args.shard is not None:
+        try:
+            getShardFiles(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    
+    if args.plan is not None:
+        for shard in planShards(args.plan)["shards"]:
+            print("Shard " + str(shard["shard"]) + ": " + str(shard["rows"]) + " rows in " + ", ".join(shard["files"]))
+        return
+    
+    if args.merge is not None:
+        try:
+            mergeShards(args.merge)
+        except ValueError as e:
+            parser.error(str(e))
+        return
+    
+    try:
+        checkEngine(args.engine)
+    except ImportError as e:
+        parser.error(str(e))
+    
+    if args.format == "parquet" and optionalModule("pyarrow") is None:
+        parser.error("parquet output needs pyarrow to be installed")
+    
+    if args.layout == "release" and (args.incremental or args.shard is not None or args.watch):
+        parser.error("release files are written from every piece, so cannot be used with --incremental, --shard or --watch")
+    
+    if args.profile and args.pipeline:
+        parser.error("the stages of different spreadsheets overlap in the pipeline, so it cannot be used with --profile")
+    
+    options = RunOptions(workers=args.workers, incremental=args.incremental, engine=args.engine, dateWindow=args.date_window, profile=args.profile, verifyEvery=args.verify_every, 
+        pipeline=(args.queue_size, args.writers) if args.pipeline else None, outputFormat=args.format, layout=args.layout)
+    
+    if args.validate_only:
+        report = validateFiles(args.coveringDateFile, options)
+        print(json.dumps(report, indent=1))
+        sys.exit(1 if len(report["failed"]) > 0 else 0)
+    
+    if args.watch:
+        watchFiles(args.coveringDateFile, options, interval=args.interval, settle=args.settle)
+        return
+    
+    generateFiles(args.coveringDateFile, options=options, resume=args.resume, shard=args.shard)
+
+if __name__ == "__main__":
+    main()
 
 #test_get_covering_dates(getCoveringDatesbyPiece('covering_dates.csv'))
\ No newline at end of file
@@ -0,0 +1,184 @@
+# Benchmarks for the redaction pipeline on a synthetic catalogue
+
+import os, sys, json, time, random, shutil, tempfile, argparse, subprocess, contextlib, platform
+from datetime import date, datetime
+from pathlib import Path
+from openpyxl import Workbook
+
+import SpreadsheetReader as reader
+
+def generateCatalogue(root, series='HO', pieces=10, rows=500, datedShare=0.7, deceasedShare=0.1, futureYears=20, seed=0):
+    ''' Write a synthetic series of piece spreadsheets with the columns test_load_file expects, and a covering dates file for them,
+    to a data directory under root. Records open up to futureYears after the current year. Returns the date window to process them with. '''
+    rng = random.Random(seed)
+
+    # with the default age of 18 the latest records in the series open futureYears from now
+    latestYear = date.today().year - 101 + futureYears + 18
+    dateWindow = (latestYear - 11, latestYear)
+
+    os.makedirs(os.path.join(root, 'data', 'lib'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'data', 'summary'), exist_ok=True)
+
+    with open(os.path.join(root, 'data', 'lib', 'covering_dates.csv'), 'w') as dateFile:
+        for piece in range(1, pieces + 1):
+            dateFile.write(str(piece) + ", " + str(latestYear) + "\n")
+
+    for piece in range(1, pieces + 1):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(reader.inputColumns)
+
+        for item in range(1, rows + 1):
+            description = "Recommended for " + rng.choice(["rescuing", "assisting", "protecting", "treating"]) + " civilians"
+
+            if rng.random() < datedShare:
+                years = [rng.randint(dateWindow[0], dateWindow[1]) for year in range(rng.choice([1, 1, 1, 2, 3]))]
+                description += " between " + " and ".join(str(year) for year in years)
+
+            age = rng.choice([rng.randint(16, 60), "unknown"])
+            additionalInfo = "Deceased" if rng.random() < deceasedShare else rng.choice([None, "Also awarded a commendation"])
+
+            ws.append(['A', series, piece, item, 'T' + str(item), 'H' + str(item), rng.choice(['John', 'Mary', 'A.']), rng.choice(['Smith', 'Jones']),
+                age, rng.choice(['Miner', 'Nurse', 'Warden', None]), 'GM', description, additionalInfo])
+
+        wb.save(os.path.join(root, 'data', series + '_' + str(piece) + '.xlsx'))
+
+    return dateWindow
+
+def timeIt(function, repeat=1):
+    ''' return the shortest time in seconds of the given number of calls to function '''
+    times = []
+
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def runBenchmarks(dateWindow, repeat=1, workers=1):
+    ''' time each stage of the pipeline over the spreadsheets in the configured data directory '''
+    files = reader.getFileList(Path(reader.directory('data')))
+    coveringDates = reader.getCoveringDatesbyPiece('covering_dates.csv')
+    timings = {}
+
+    timings["getSpreadsheetValues"] = timeIt(lambda: [reader.getSpreadsheetValues(file) for file in files], repeat)
+
+    sheets = [reader.getSpreadsheetValues(file) for file in files]
+    coveringDateList = [reader.getCoveringDateForFile(file, coveringDates) for file in files]
+
+    def extractDates():
+        reader.getDateExtractor.cache_clear()
+        return [list(reader.getYearFromColumn(sheet['Brief summary of grounds for recommendation'], coveringDate, dateWindow)) for sheet, coveringDate in zip(sheets, coveringDateList)]
+
+    timings["getYearFromColumn"] = timeIt(extractDates, repeat)
+
+    pieces = []
+
+    for file, sheet, coveringDate, dates in zip(files, sheets, coveringDateList, extractDates()):
+        ageList = reader.getAgeFromColumn(sheet['Age'])
+        yearList = [parts[0] for parts in dates]
+        coveringDatesList = [coveringDate] * len(yearList)
+        reader.insertCoveringDateValues(sheet, coveringDatesList)
+
+        openingListByPiece = reader.unredactIfDeceased(reader.createOpeningList(ageList, coveringDatesList), sheet['Additional Information'])
+        originalOpeningList = reader.createOpeningList(ageList, yearList)
+        openingList = reader.unredactIfDeceased(originalOpeningList, sheet['Additional Information'])
+        changesToOpening = reader.test_unredaction_due_to_death(originalOpeningList, openingList, sheet['Additional Information'])
+
+        pieces.append((file, sheet, ageList, coveringDatesList, openingListByPiece, openingList, changesToOpening))
+
+    def columnsToRedact(sheet):
+        return dict((key, sheet[key]) for key in ['Occupation', 'Brief summary of grounds for recommendation'])
+
+    timings["redactColumns"] = timeIt(lambda: [reader.redactColumns(columnsToRedact(sheet), openingList, dateWindow[1]) for file, sheet, *lists, openingList, changes in pieces], repeat)
+
+    def writeSpreadsheets():
+        shutil.rmtree(reader.directory('output'), ignore_errors=True)
+
+        for file, sheet, *lists, openingList, changes in pieces:
+            if reader.sheetRedactionNeededCheck(openingList):
+                reader.generateSpreadsheets(os.path.basename(file), sheet, reader.redactColumns(columnsToRedact(sheet), openingList, dateWindow[1]), openingList)
+            else:
+                reader.spreadsheetNoRedactions(os.path.basename(file), sheet)
+
+    timings["generateSpreadsheets"] = timeIt(writeSpreadsheets, repeat)
+
+    def writeSummary():
+        reader.writeSummary([reader.generateSummary(os.path.splitext(os.path.basename(file))[0], *lists) for file, sheet, *lists in pieces])
+
+    timings["generateSummary"] = timeIt(writeSummary, repeat)
+
+    def generateFiles():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            reader.generateFiles('covering_dates.csv', workers=workers, dateWindow=dateWindow)
+
+    timings["generateFiles"] = timeIt(generateFiles, repeat)
+
+    return timings
+
+def gitRevision():
+    ''' return the current git commit of the code being benchmarked, if there is one '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def loadResults(filename):
+    ''' return the list of earlier benchmark results saved in a json lines file '''
+    if not os.path.exists(filename):
+        return []
+
+    with open(filename) as resultsFile:
+        return [json.loads(line) for line in resultsFile if line.strip()]
+
+def compareResults(result, previous):
+    ''' print the timings of the run against the last run with the same parameters '''
+    for name, seconds in result["timings"].items():
+        line = "{:<22}{:>10.3f}s".format(name, seconds)
+
+        if previous is not None and previous["timings"].get(name):
+            line += "  {:>6.2f}x vs {}".format(seconds / previous["timings"][name], previous["revision"] or previous["timestamp"])
+
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the redaction pipeline on a synthetic catalogue and save the timings")
+    parser.add_argument("--pieces", type=int, default=10, help="number of piece spreadsheets in the series")
+    parser.add_argument("--rows", type=int, default=500, help="number of rows in each piece")
+    parser.add_argument("--dated-share", type=float, default=0.7, help="share of descriptions that contain dates")
+    parser.add_argument("--deceased-share", type=float, default=0.1, help="share of rows marked as Deceased")
+    parser.add_argument("--future-years", type=int, default=20, help="number of years from now until the last records open")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic catalogue")
+    parser.add_argument("--repeat", type=int, default=1, help="number of times each benchmark is run, the fastest is kept")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes used by the full generateFiles run")
+    parser.add_argument("--results", default="benchmark_results.jsonl", help="json lines file the results are appended to")
+    parser.add_argument("--keep", metavar="DIRECTORY", help="generate the catalogue in this directory and keep it, rather than a temporary one")
+    args = parser.parse_args()
+
+    parameters = {"pieces": args.pieces, "rows": args.rows, "datedShare": args.dated_share, "deceasedShare": args.deceased_share,
+        "futureYears": args.future_years, "seed": args.seed, "repeat": args.repeat, "workers": args.workers}
+    resultsFile = os.path.abspath(args.results)
+    root = os.path.abspath(args.keep) if args.keep else tempfile.mkdtemp()
+
+    try:
+        dateWindow = generateCatalogue(root, pieces=args.pieces, rows=args.rows, datedShare=args.dated_share, deceasedShare=args.deceased_share, futureYears=args.future_years, seed=args.seed)
+        reader.configureDirectories(os.path.join(root, 'data'))
+        timings = runBenchmarks(dateWindow, args.repeat, args.workers)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    result = {"timestamp": datetime.now().isoformat(timespec="seconds"), "revision": gitRevision(), "python": platform.python_version(),
+        "parameters": parameters, "timings": timings}
+    previous = [earlier for earlier in loadResults(resultsFile) if earlier["parameters"] == parameters]
+
+    compareResults(result, previous[-1] if len(previous) > 0 else None)
+
+    with open(resultsFile, 'a') as results:
+        results.write(json.dumps(result) + "\n")
+
+    print("Results saved to " + resultsFile)
+
+if __name__ == "__main__":
+    main()
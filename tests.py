@@ -1,4 +1,582 @@
+import os, sys, re, csv, json, shutil, importlib, threading, tracemalloc
+from collections import Counter
+from contextlib import closing
+from datetime import date
+from pathlib import Path
+
+import pytest
+from openpyxl import load_workbook
+
+import SpreadsheetReader as reader
+import benchmarks
+
 def test_loadfile(column_headings):
     expected_columns = ['Letter','Series','Piece', 'Item', 'Treasury Case number', 'Home Office case number', 'First names/Initials', 'Surname', 'Age', 'Occupation', 'Award granted', 'Brief summary of grounds for recommendation'];
     
-    assert column_headings == expected_columns
\ No newline at end of file
+    assert column_headings == expected_columns
+
+### CompactColumn ###
+
+# columns of whole numbers, blanks, text, a single repeated value and numbers too big for the array
+columnCases = [
+    [],
+    [1, 2, 3],
+    [1935, "", 1946, None, 2023, 0, -5],
+    ["", "", ""],
+    ["a", "b", "", "a", 1, 2.5],
+    [7] * 20,
+    ["same"] * 9,
+    [2**63, 1, ""],
+    list(range(17)) + ["", "text"] + list(range(5))
+]
+
+def blank(value):
+    return value is None or value == ""
+
+def test_compact_column_round_trip():
+    for values in columnCases:
+        expected = ["" if blank(value) else value for value in values]
+
+        for column in (reader.CompactColumn(values), reader.CompactColumn(iter(values)), reader.CompactColumn(values).compact()):
+            assert list(column) == expected, values
+            assert len(column) == len(expected)
+            assert [column[index] for index in range(len(column))] == expected
+            assert column[1:-1] == expected[1:-1]
+            assert column.blanks == sum(1 for value in values if blank(value))
+
+def test_compact_column_truncate():
+    for values in columnCases:
+        expected = ["" if blank(value) else value for value in values]
+
+        for length in range(len(values) + 2):
+            column = reader.CompactColumn(values).compact()
+            column.truncate(length)
+            assert list(column) == expected[:length], (values, length)
+            assert column.blanks == sum(1 for value in values[:length] if blank(value))
+
+            # rows added after truncating are not hidden by bits left over from the rows removed
+            column.append(1)
+            assert list(column) == expected[:length] + [1]
+
+def test_compact_column_compact_then_append():
+    for values in columnCases:
+        expected = ["" if blank(value) else value for value in values]
+
+        for value in (expected[0] if len(expected) > 0 else 1, 3, "new", "", None):
+            column = reader.CompactColumn(values).compact()
+            column.append(value)
+            assert list(column) == expected + ["" if blank(value) else value], (values, value)
+            assert column[-1] == ("" if blank(value) else value)
+
+def test_compact_column_present():
+    for values in columnCases:
+        expected = [value for value in values if not blank(value)]
+        present = reader.CompactColumn(values).compact().present()
+
+        # the present values can be read more than once
+        assert list(present) == expected, values
+        assert list(present) == expected
+        assert len(present) == len(expected)
+        assert list(reader.removeBlanksFromColumn(reader.CompactColumn(values))) == expected
+
+### DateExtractor ###
+
+descriptions = [
+    "No dates given",
+    "",
+    "Rescued survivors in 1940",
+    "Served from 1939 to 1944",
+    "Born 1901, served 1941",
+    "Served 1930 and 1950",
+    "Bombing of 1946 and 1935",
+    "1935",
+    "1946",
+    "1947 onwards",
+    "Between 1914 and 1918, again in 1940 and 1942",
+    "Reference 123456 in 1943",
+    "Dates 1941 1938 1944 1936",
+    "Years 1950 1960"
+]
+
+windows = [(1935, 1946), (1939, 1945), (1914, 1918), (1900, 2000)]
+
+def codifiedDescriptions(entries, coveringDate, earliest, latest):
+    ''' the dates of the descriptions as the years were worked out before the date extractor, with a regex search of each description and codifyYears '''
+    years = [int(found[0]) if len(found := re.findall(r'\d{4}', entry)) == 1 else found for entry in entries]
+    return list(reader.codifyYears(years, coveringDate, earliest, latest))
+
+def test_date_extractor_matches_codify_years():
+    for earliest, latest in windows:
+        extractor = reader.DateExtractor(earliest, latest)
+
+        for coveringDate in (1940, ""):
+            expected = codifiedDescriptions(descriptions, coveringDate, earliest, latest)
+            assert [extractor.extract(entry, coveringDate) for entry in descriptions] == expected, (earliest, latest, coveringDate)
+            # the remembered scans give the same results the second time
+            assert [extractor.extract(entry, coveringDate) for entry in descriptions] == expected
+            assert list(reader.getYearFromColumn(descriptions, coveringDate, (earliest, latest))) == [pair for entry, pair in zip(descriptions, expected) if entry != ""]
+
+### RedactionSchedule ###
+
+def oldRedactedColumns(columnsToRedact, openingList, boilerplate):
+    ''' the redacted columns for each year as they were built before the RedactionSchedule, with a list of rows to redact for each year and a filter from selectByYear '''
+    processedColumns = {"base": columnsToRedact}
+    previousRedactions = []
+
+    for currentYear in reader.yearsToPublish(openingList):
+        toRedact = [True if currentYear < openingYear else False for openingYear in openingList]
+        filter = [True] * len(openingList)
+
+        if previousRedactions == []:
+            previousRedactions = toRedact
+        else:
+            filter = reader.selectByYear(previousRedactions, toRedact)
+            previousRedactions = toRedact
+
+        processedColumns[currentYear] = {"filter": filter}
+
+        for columnName, column in columnsToRedact.items():
+            processedColumns[currentYear][columnName] = [boilerplate if record[1] and record[0] != "" else record[0] for record in zip(column, toRedact)]
+
+    return processedColumns
+
+thisYear = date.today().year
+
+openingCases = [
+    [thisYear + 3, thisYear - 10, thisYear + 1, thisYear + 3, thisYear],
+    [thisYear] * 4,
+    [thisYear + 5],
+    [thisYear - 1, thisYear + 2, thisYear + 2, thisYear - 40, thisYear + 7, thisYear + 1]
+]
+
+def test_redaction_schedule_matches_old_redaction():
+    groupings = [reader.groupRowsByOpeningYear]
+
+    if reader.optionalModule("numpy") is not None:
+        groupings.append(reader.groupRowsByOpeningYearNumpy)
+
+    for openingList in openingCases:
+        columns = {"Occupation": ["Fireman", "", "Warden", "Nurse", "Driver", "Clerk"][:len(openingList)],
+            "Brief summary of grounds for recommendation": ["Rescued a child in " + str(year) for year in range(len(openingList))]}
+
+        for groupRows in groupings:
+            schedule = reader.redactColumns(columns, openingList, 1946, groupRows=groupRows)
+            expected = oldRedactedColumns(columns, openingList, schedule.boilerplate)
+
+            assert list(schedule) == list(expected), openingList
+            assert schedule["base"] == expected["base"]
+
+            for year in reader.yearsToPublish(openingList):
+                assert list(schedule[year]) == list(expected[year])
+                assert schedule[year]["filter"] == expected[year]["filter"], (openingList, year)
+                assert list(schedule[year].rowIndexes()) == [index for index, selected in enumerate(expected[year]["filter"]) if selected]
+
+                for columnName in columns:
+                    assert list(schedule[year][columnName]) == expected[year][columnName], (openingList, year, columnName)
+
+### generateFiles ###
+
+@pytest.fixture
+def catalogue(tmp_path):
+    ''' a small synthetic series in a data directory under tmp_path, returning the date window to process it with '''
+    dateWindow = benchmarks.generateCatalogue(str(tmp_path), pieces=4, rows=60)
+    reader.configureDirectories(str(tmp_path / 'data'))
+    yield dateWindow
+    reader.configureDirectories()
+
+def readOutput(filename):
+    ''' the rows of a csv or parquet file, or of each sheet of a spreadsheet '''
+    if filename.endswith('.csv'):
+        with open(filename, newline='', encoding='utf-8') as csvFile:
+            return list(csv.reader(csvFile))
+    
+    if filename.endswith('.parquet'):
+        return importlib.import_module("pyarrow.parquet").read_table(filename).to_pylist()
+    
+    wb = load_workbook(filename, read_only=True)
+    
+    try:
+        return {ws.title: list(ws.iter_rows(values_only=True)) for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+def writtenFiles():
+    ''' the rows of every file in the output and summary directories, by directory and path '''
+    return {(name, os.path.relpath(os.path.join(folder, fileName), reader.directory(name))): readOutput(os.path.join(folder, fileName))
+        for name in ("output", "summary") for folder, folders, fileNames in os.walk(reader.directory(name)) for fileName in fileNames}
+
+@pytest.mark.parametrize("options", [{"workers": 2}, {"pipeline": (1, 3)}])
+def test_parallel_runs_write_the_same_files(catalogue, options):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue)
+    expected = writtenFiles()
+    assert len(expected) > 1
+    
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue, **options)
+    assert writtenFiles() == expected
+
+def test_pipeline_stops_reading_when_a_piece_fails(catalogue, monkeypatch):
+    def failingComputePiece(piece, *args):
+        raise RuntimeError("failed to work out the piece")
+    
+    monkeypatch.setattr(reader, "computePiece", failingComputePiece)
+    fileList = reader.getFileList(Path(reader.directory('data')))
+    results = reader.pipelineFiles(fileList, [None] * len(fileList), [False] * len(fileList), reader.RunOptions(pipeline=(1, 1)))
+    
+    with pytest.raises(RuntimeError):
+        next(results)
+    
+    # the reader is not left waiting on the full queue with the pieces it read
+    for thread in threading.enumerate():
+        if thread.name == "pipelineReader":
+            thread.join(timeout=5)
+            assert not thread.is_alive()
+
+def test_numpy_engine_without_numpy_fails_before_anything_is_written(catalogue, monkeypatch):
+    optionalModule = reader.optionalModule
+    monkeypatch.setattr(reader, "optionalModule", lambda name: None if name == "numpy" else optionalModule(name))
+    
+    with pytest.raises(ImportError, match="needs numpy"):
+        reader.generateFiles('covering_dates.csv', dateWindow=catalogue, engine="numpy")
+    
+    assert not os.path.exists(reader.directory('data', 'journal.jsonl'))
+    assert outputPaths("output") == []
+
+def test_profile_files_run_stages_under_run(catalogue):
+    try:
+        reader.generateFiles('covering_dates.csv', dateWindow=catalogue, profile=True)
+    finally:
+        # the profiler leaves tracemalloc running, which would slow down every test after this one
+        tracemalloc.stop()
+    
+    with open(reader.directory('data', 'profile', 'profile.json')) as profileFile:
+        report = json.load(profileFile)
+    
+    assert set(report["byFile"]) == {"run"} | {os.path.basename(file) for file in reader.getFileList(Path(reader.directory('data')))}
+    assert {record["stage"] for record in report["records"] if record["file"] == "run"} >= {"writeSummary"}
+
+### incremental runs ###
+
+def runIncremental(capsys, dateWindow, **options):
+    ''' run generateFiles incrementally and return the spreadsheets it skipped as unchanged '''
+    capsys.readouterr()
+    reader.generateFiles('covering_dates.csv', dateWindow=dateWindow, incremental=True, **options)
+    return set(re.findall(r'Skipping (\S+), unchanged', capsys.readouterr().out))
+
+def pieces():
+    return set(os.path.basename(file) for file in reader.getFileList(Path(reader.directory('data'))))
+
+def test_incremental_run_skips_unchanged_files(catalogue, capsys):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue)
+    expected = writtenFiles()
+    
+    assert runIncremental(capsys, catalogue) == pieces()
+    assert writtenFiles() == expected
+
+def test_incremental_run_reprocesses_changed_contents(catalogue, capsys):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue, incremental=True)
+    
+    wb = load_workbook(reader.directory('data', 'HO_1.xlsx'))
+    wb.worksheets[0].cell(row=2, column=reader.inputColumns.index('Age') + 1).value = 17
+    wb.save(reader.directory('data', 'HO_1.xlsx'))
+    
+    assert runIncremental(capsys, catalogue) == pieces() - {'HO_1.xlsx'}
+
+def test_incremental_run_reprocesses_changed_covering_dates(catalogue, capsys):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue, incremental=True)
+    
+    with open(reader.directory('lib', 'covering_dates.csv')) as dateFile:
+        lines = [("2, " + str(catalogue[0]) + "\n") if line.startswith("2,") else line for line in dateFile]
+    
+    with open(reader.directory('lib', 'covering_dates.csv'), 'w') as dateFile:
+        dateFile.writelines(lines)
+    
+    assert runIncremental(capsys, catalogue) == pieces() - {'HO_2.xlsx'}
+
+def test_incremental_run_replaces_outputs_in_a_new_format(catalogue, capsys):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue, incremental=True)
+    
+    assert runIncremental(capsys, catalogue, outputFormat="csv") == set()
+    assert all(path.endswith('.csv') for name, path in writtenFiles() if name == "output")
+
+def test_incremental_run_removes_outputs_of_deleted_inputs(catalogue, capsys):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue, incremental=True)
+    os.remove(reader.directory('data', 'HO_3.xlsx'))
+    
+    assert runIncremental(capsys, catalogue) == pieces()
+    assert not any(os.path.basename(path).startswith('HO_3_') for name, path in writtenFiles())
+    assert 'HO_3' not in writtenFiles()[("summary", "summary.xlsx")]
+    assert 'HO_3.xlsx' not in reader.loadManifest()["files"]
+
+def test_full_run_leaves_hashing_to_incremental_runs(catalogue, capsys):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue)
+    assert all(entry["hash"] is None for entry in reader.loadManifest()["files"].values())
+    
+    # with no hash from the full run, a spreadsheet saved again unchanged is processed once more, and compared by its hash after that
+    stat = os.stat(reader.directory('data', 'HO_1.xlsx'))
+    os.utime(reader.directory('data', 'HO_1.xlsx'), (stat.st_atime, stat.st_mtime + 10))
+    assert runIncremental(capsys, catalogue) == pieces() - {'HO_1.xlsx'}
+    assert reader.loadManifest()["files"]['HO_1.xlsx']["hash"] == reader.hashFile(reader.directory('data', 'HO_1.xlsx'))
+    
+    os.utime(reader.directory('data', 'HO_1.xlsx'), (stat.st_atime, stat.st_mtime + 20))
+    assert runIncremental(capsys, catalogue) == pieces()
+
+### resume ###
+
+def stopPartway(monkeypatch, dateWindow, **options):
+    ''' start a run that stops with an error on the third spreadsheet, and return the spreadsheets in the order they are processed '''
+    processFile = reader.processFile
+    fileList = [os.path.basename(file) for file in reader.getFileList(Path(reader.directory('data')))]
+    
+    def failingProcessFile(file, *args):
+        if os.path.basename(file) == fileList[2]:
+            raise RuntimeError("stopped partway through")
+        return processFile(file, *args)
+    
+    monkeypatch.setattr(reader, "processFile", failingProcessFile)
+    
+    with pytest.raises(RuntimeError):
+        reader.generateFiles('covering_dates.csv', dateWindow=dateWindow, **options)
+    
+    monkeypatch.setattr(reader, "processFile", processFile)
+    return fileList
+
+def test_resume_skips_journalled_files(catalogue, capsys, monkeypatch):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue)
+    expected = writtenFiles()
+    fileList = stopPartway(monkeypatch, catalogue)
+    
+    capsys.readouterr()
+    reader.generateFiles(resume=True)
+    
+    assert set(re.findall(r'Skipping (\S+), already done', capsys.readouterr().out)) == set(fileList[:2])
+    assert writtenFiles() == expected
+    assert not os.path.exists(reader.directory('data', 'journal.jsonl'))
+
+def test_resume_starts_release_runs_again(catalogue, monkeypatch):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue, layout="release")
+    expected = writtenFiles()
+    stopPartway(monkeypatch, catalogue, layout="release")
+    
+    reader.generateFiles(resume=True)
+    assert writtenFiles() == expected
+
+### output checks ###
+
+itemsOnLoad = [1, 2, 3]
+
+def trackedOutput(tmp_path, rows, outputFormat="csv"):
+    ''' write the rows through WrittenRows as writePiece does, for an output that should hold every row loaded '''
+    written = reader.WrittenRows()
+    newFile = str(tmp_path / ("output." + outputFormat))
+    rowCount = reader.writeRows(newFile, ["Item", "Age"], written.track(newFile, ["Item", "Age"], range(len(itemsOnLoad)), rows), outputFormat)
+    written.wrote(newFile, rowCount)
+    return written.outputs[newFile]
+
+def checkOutput(outputRows):
+    reader.test_output_items(itemsOnLoad, reader.inputColumns + ['Covering Dates'], reader.removeBlanksFromColumn(outputRows["items"]))
+    reader.test_output_rows(outputRows, itemsOnLoad)
+
+def test_output_checks_pass_the_rows_loaded(tmp_path):
+    for outputFormat in ("csv", "xlsx"):
+        checkOutput(trackedOutput(tmp_path, [[1, 20], [2, 30], [3, 40]], outputFormat))
+
+def test_output_checks_catch_a_wrong_row(tmp_path):
+    outputRows = trackedOutput(tmp_path, [[1, 20], [9, 30], [3, 40]])
+    
+    with pytest.raises(AssertionError, match="Unexpected items"):
+        reader.test_output_items(itemsOnLoad, reader.inputColumns + ['Covering Dates'], reader.removeBlanksFromColumn(outputRows["items"]))
+    
+    with pytest.raises(AssertionError, match="Missing items"):
+        reader.test_output_rows(outputRows, itemsOnLoad)
+
+def test_output_checks_catch_a_missing_row(tmp_path):
+    with pytest.raises(AssertionError, match="2 rows written"):
+        checkOutput(trackedOutput(tmp_path, [[1, 20], [3, 40]]))
+
+def test_output_checks_catch_rows_the_writer_dropped(tmp_path):
+    outputRows = trackedOutput(tmp_path, [[1, 20], [2, 30], [3, 40]])
+    outputRows["written"] = 2
+    
+    with pytest.raises(AssertionError, match="2 rows written"):
+        checkOutput(outputRows)
+
+def test_output_checks_catch_rows_never_written():
+    written = reader.WrittenRows()
+    written.track("output.csv", ["Item", "Age"], range(len(itemsOnLoad)), iter([[1, 20], [2, 30], [3, 40]]))
+    
+    with pytest.raises(AssertionError, match="0 rows written"):
+        checkOutput(written.outputs["output.csv"])
+
+def test_generate_files_catches_a_wrong_row(catalogue, monkeypatch):
+    yearRows = reader.yearRows
+    position = reader.inputColumns.index('Item')
+    
+    def wrongYearRows(*args, **kwargs):
+        rowIndexes, rows = yearRows(*args, **kwargs)
+        return rowIndexes, (row[:position] + [-1] + row[position + 1:] for row in rows)
+    
+    monkeypatch.setattr(reader, "yearRows", wrongYearRows)
+    
+    with pytest.raises(AssertionError, match="Unexpected items"):
+        reader.generateFiles('covering_dates.csv', dateWindow=catalogue)
+
+### output formats ###
+
+def outputPaths(name):
+    return [os.path.join(folder, fileName) for folder, folders, fileNames in os.walk(reader.directory(name)) for fileName in fileNames]
+
+def blankColumn(filename, heading):
+    ''' empty a column of a spreadsheet, so that nothing about its type can be told from its values '''
+    wb = load_workbook(filename)
+    ws = wb.worksheets[0]
+    
+    for row in range(2, ws.max_row + 1):
+        ws.cell(row=row, column=reader.inputColumns.index(heading) + 1).value = None
+    
+    wb.save(filename)
+
+def test_csv_files_share_their_headings(catalogue):
+    blankColumn(reader.directory('data', 'HO_1.xlsx'), 'Occupation')
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue, outputFormat="csv")
+    
+    for name, headings in (("output", reader.inputColumns + ['Covering Dates']), ("summary", reader.summaryHeadings)):
+        paths = outputPaths(name)
+        assert len(paths) > 1 and all(path.endswith('.csv') for path in paths)
+        assert all(readOutput(path)[0] == headings for path in paths)
+
+def test_parquet_files_share_a_schema(catalogue):
+    pq = pytest.importorskip("pyarrow.parquet")
+    blankColumn(reader.directory('data', 'HO_1.xlsx'), 'Occupation')
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue, outputFormat="parquet")
+    
+    for name, schema in (("output", reader.parquetSchema(reader.inputColumns + ['Covering Dates'])), ("summary", reader.parquetSchema(reader.summaryHeadings, reader.summaryIntegerHeadings))):
+        paths = outputPaths(name)
+        assert len(paths) > 1 and all(path.endswith('.parquet') for path in paths)
+        assert all(pq.read_schema(path).equals(schema) for path in paths), name
+    
+    # every file can be read back as one dataset
+    assert pq.ParquetDataset(outputPaths("output")).read().num_rows > 0
+
+### layouts ###
+
+def rowsByYear(layout):
+    ''' the rows written for each year by a layout, whichever files they were written to '''
+    years = {}
+    
+    for path in outputPaths("output"):
+        output = readOutput(path)
+        sheets = output.items() if isinstance(output, dict) else [(None, output)]
+        
+        for title, rows in sheets:
+            headings, rows = rows[0], rows[1:]
+            
+            if layout == "year":
+                year = os.path.basename(os.path.dirname(path))
+            elif layout == "release":
+                year = os.path.splitext(os.path.basename(path))[0].split('_')[1]
+            elif title is not None:
+                year = title
+            
+            for row in rows:
+                if layout == "piece" and title is None:
+                    year, row = row[0], row[1:]
+                years.setdefault(str(year), Counter())[tuple(row)] += 1
+    
+    return years
+
+@pytest.mark.parametrize("outputFormat", ["xlsx", "csv"])
+def test_layouts_write_the_same_rows_each_year(catalogue, outputFormat):
+    written = {}
+    
+    for layout in ("year", "piece", "release"):
+        reader.generateFiles('covering_dates.csv', dateWindow=catalogue, outputFormat=outputFormat, layout=layout)
+        written[layout] = rowsByYear(layout)
+    
+    assert len(written["year"]) > 1
+    assert written["piece"] == written["year"]
+    assert written["release"] == written["year"]
+
+def test_piece_layout_catches_rows_the_writer_dropped(catalogue, monkeypatch):
+    writeRows = reader.writeRows
+    
+    def droppingWriteRows(newFile, headings, rows, *args):
+        return writeRows(newFile, headings, list(rows)[:-1], *args)
+    
+    monkeypatch.setattr(reader, "writeRows", droppingWriteRows)
+    
+    with pytest.raises(AssertionError, match="rows written to"):
+        reader.generateFiles('covering_dates.csv', dateWindow=catalogue, outputFormat="csv", layout="piece")
+
+### shards ###
+
+def indexRows():
+    with closing(reader.openIndex()) as index:
+        return sorted(tuple(row) for row in index.execute("SELECT * FROM items"))
+
+def test_merged_shards_match_a_single_run(catalogue, tmp_path):
+    reader.generateFiles('covering_dates.csv', dateWindow=catalogue)
+    expected = writtenFiles()
+    expectedIndex = indexRows()
+    plan = reader.planShards(2)
+    assert all(len(shard["files"]) > 0 for shard in plan["shards"])
+    
+    for shard in range(2):
+        shutil.copytree(tmp_path / 'data', tmp_path / ('shard' + str(shard)) / 'data', ignore=shutil.ignore_patterns('converted', 'summary', '*.sqlite', 'manifest.json'))
+        # the second shard writes its output outside its data directory, which the merge finds from its manifest
+        reader.configureDirectories(str(tmp_path / ('shard' + str(shard)) / 'data'), str(tmp_path / 'shard1' / 'converted') if shard == 1 else None)
+        reader.generateFiles('covering_dates.csv', dateWindow=catalogue, shard=shard)
+    
+    os.makedirs(tmp_path / 'merged')
+    shutil.copy(tmp_path / 'data' / 'shards.json', tmp_path / 'merged')
+    reader.configureDirectories(str(tmp_path / 'merged'))
+    reader.mergeShards([str(tmp_path / 'shard0' / 'data'), str(tmp_path / 'shard1' / 'data')])
+    
+    assert writtenFiles() == expected
+    assert indexRows() == expectedIndex and len(expectedIndex) > 0
+    assert sorted(reader.loadManifest()["files"]) == sorted(plan["order"])
+
+### validate only ###
+
+def snapshot(folder):
+    ''' the size and modification time of every file under a folder '''
+    return {path: (os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in (os.path.join(parent, fileName) for parent, folders, fileNames in os.walk(folder) for fileName in fileNames)}
+
+def validateOnly(capsys, monkeypatch, dateWindow):
+    ''' run the script with --validate-only on the catalogue and return its exit status and report '''
+    monkeypatch.setattr(sys, "argv", ["SpreadsheetReader.py", "--data", reader.directory('data'), "--date-window"] + [str(year) for year in dateWindow] + ["--validate-only"])
+    capsys.readouterr()
+    
+    with pytest.raises(SystemExit) as exit:
+        reader.main()
+    
+    return exit.value.code, json.loads(capsys.readouterr().out)
+
+def test_validate_only_passes_a_clean_catalogue(catalogue, capsys, monkeypatch):
+    status, report = validateOnly(capsys, monkeypatch, catalogue)
+    
+    assert status == 0
+    assert report["failed"] == [] and report["laterThanCoveringDate"] == []
+    assert len(report["files"]) == 4
+
+def test_validate_only_reports_issues_without_writing(catalogue, capsys, monkeypatch):
+    wb = load_workbook(reader.directory('data', 'HO_1.xlsx'))
+    wb.worksheets[0].cell(row=1, column=reader.inputColumns.index('Age') + 1).value = 'Age at award'
+    wb.save(reader.directory('data', 'HO_1.xlsx'))
+    
+    with open(reader.directory('data', 'HO_5.xlsx'), 'wb') as corruptFile:
+        corruptFile.write(b'not a spreadsheet')
+    
+    # HO_2 loses its covering date, and HO_3 is given one earlier than the dates in its descriptions
+    with open(reader.directory('lib', 'covering_dates.csv')) as dateFile:
+        lines = [line for line in dateFile if not line.startswith("2,")]
+    
+    with open(reader.directory('lib', 'covering_dates.csv'), 'w') as dateFile:
+        dateFile.writelines(("3, " + str(catalogue[0]) + "\n") if line.startswith("3,") else line for line in lines)
+    
+    before = snapshot(reader.directory('data'))
+    status, report = validateOnly(capsys, monkeypatch, catalogue)
+    
+    assert status == 1
+    assert sorted(report["failed"]) == ['HO_1.xlsx', 'HO_2.xlsx', 'HO_5.xlsx']
+    assert report["laterThanCoveringDate"] == ['HO_3.xlsx']
+    assert snapshot(reader.directory('data')) == before